@@ -1,5 +1,9 @@
 """'Lightweight python modules useful in most projects'"""
+import io
 import os
+import ssl
+import asyncio
+import email.message
 from datetime import datetime
 import urllib.error
 import urllib.request
@@ -86,11 +90,25 @@ def profile(new_profile=None):
     if PRO_KEY not in os.environ:
         os.environ[PRO_KEY] = PRO_DEFAULT
     if new_profile is not None:
+        old_profile = os.environ[PRO_KEY]
         os.environ[PRO_KEY] = new_profile
+        if new_profile != old_profile:
+            for listener in _profile_listeners:
+                listener(old_profile, new_profile)
     prf = os.environ[PRO_KEY]
     return prf
 
 
+_profile_listeners = []
+
+
+# --------------------------------------------------------------------------- #
+# register a callable(old_profile, new_profile) to be notified when profile()
+# switches to a different profile, e.g. to drop cached AWS clients
+def on_profile_change(listener):
+    _profile_listeners.append(listener)
+
+
 # --------------------------------------------------------------------------- #
 # Datetime formatting functions
 # --------------------------------------------------------------------------- #
@@ -172,6 +190,168 @@ def http_get(url, headers=None):
     return response_data
 
 
+# --------------------------------------------------------------------------- #
+# asyncio versions of http_post and http_get, a small HTTP/1.1 client on
+# asyncio streams so cancelling the awaiting task aborts the request.  Each
+# request (connect, send and read) must finish within `timeout` seconds or
+# TimeoutError is raised.  When HTTP(S)_PROXY applies to the url the request
+# goes through urllib (and its proxy handling) on a worker thread instead,
+# which cancelling can't interrupt.
+# --------------------------------------------------------------------------- #
+
+HTTP_MAX_REDIRECTS = 5
+HTTP_TIMEOUT = 60
+
+
+@emitter()
+async def ahttp_post(url, data=None, headers=None, timeout=HTTP_TIMEOUT):
+
+    if data is None:
+        data = {}
+    if headers is None:
+        headers = {}
+
+    if 'Content-Type' not in headers:
+        headers['Content-Type'] = 'application/x-www-form-urlencoded'
+
+    print(f"{url} data: {data} headers: {headers}")
+
+    if isinstance(data, dict):
+        data = urllib.parse.urlencode(data)
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+
+    status, reason, _, body = await _ahttp_request('POST', url, data, headers, timeout)
+    response_data = body.decode('utf-8')
+    if status >= 400:
+        print(f"ERROR: {status} {reason} {response_data}")
+        return response_data
+    print(f"SUCCESS: {response_data}")
+    return response_data
+
+
+@emitter()
+async def ahttp_get(url, headers=None, timeout=HTTP_TIMEOUT):
+
+    if headers is None:
+        headers = {}
+
+    print(f"{url} headers: {headers}")
+    status, reason, response_headers, body = await _ahttp_request('GET', url, None, headers, timeout)
+    if status >= 400:
+        raise urllib.error.HTTPError(url, status, reason, response_headers, io.BytesIO(body))
+    response_data = body.decode('utf-8')
+
+    print(f"SUCCESS: {response_data}")
+    return response_data
+
+
+# --------------------------------------------------------------------------- #
+# one request per connection (Connection: close), following redirects like
+# urlopen does.  Returns (status, reason, headers, body bytes).
+async def _ahttp_request(method, url, data, headers, timeout):
+    if _proxied(url):
+        return await asyncio.to_thread(_http_request_urllib, method, url, data, headers, timeout)
+    for _ in range(HTTP_MAX_REDIRECTS + 1):
+        status, reason, response_headers, body = await asyncio.wait_for(
+            _ahttp_request_once(method, url, data, headers), timeout)
+        location = response_headers.get('Location')
+        if status not in (301, 302, 303, 307, 308) or not location:
+            return status, reason, response_headers, body
+        url = urllib.parse.urljoin(url, location)
+        if _proxied(url):
+            return await asyncio.to_thread(_http_request_urllib, method, url, data, headers, timeout)
+        if status == 303 or (status in (301, 302) and method == 'POST'):
+            method, data = 'GET', None
+    raise urllib.error.HTTPError(url, status, f"more than {HTTP_MAX_REDIRECTS} redirects", response_headers,
+                                 io.BytesIO(body))
+
+
+async def _ahttp_request_once(method, url, data, headers):
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme not in ('http', 'https'):
+        raise Exception(f"unsupported url scheme: {url}")
+    if not parts.hostname:
+        raise Exception(f"no host in url: {url}")
+    tls = parts.scheme == 'https'
+    port = parts.port or (443 if tls else 80)
+    target = parts.path or '/'
+    if parts.query:
+        target += f"?{parts.query}"
+
+    reader, writer = await asyncio.open_connection(
+        parts.hostname, port, ssl=ssl.create_default_context() if tls else None)
+    try:
+        host = f"[{parts.hostname}]" if ':' in parts.hostname else parts.hostname
+        if parts.port is not None:
+            host += f":{parts.port}"
+        lines = [f"{method} {target} HTTP/1.1", f"Host: {host}", "Connection: close",
+                 "Accept-Encoding: identity"]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        if data is not None:
+            lines.append(f"Content-Length: {len(data)}")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1'))
+        if data is not None:
+            writer.write(data)
+        await writer.drain()
+
+        status_line = (await reader.readline()).decode('latin-1').strip()
+        _, status, reason = (status_line.split(' ', 2) + [''])[:3]
+        response_headers = email.message.Message()
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            response_headers[name.strip()] = value.strip()
+
+        if method == 'HEAD' or status.startswith('1') or status in ('204', '304'):
+            body = b''
+        elif response_headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            body = await _aread_chunked(reader)
+        elif response_headers.get('Content-Length') is not None:
+            body = await reader.readexactly(int(response_headers['Content-Length']))
+        else:
+            body = await reader.read()
+        return int(status), reason, response_headers, body
+    finally:
+        writer.close()
+        try:
+            await asyncio.wait_for(writer.wait_closed(), 5)
+        except (OSError, ssl.SSLError, asyncio.TimeoutError):
+            pass
+
+
+# True if urllib would send a request for the url through a proxy
+def _proxied(url):
+    parts = urllib.parse.urlsplit(url)
+    proxies = urllib.request.getproxies()
+    return parts.scheme in proxies and not urllib.request.proxy_bypass(parts.hostname or '')
+
+
+# the blocking request through urllib, returns what _ahttp_request does
+def _http_request_urllib(method, url, data, headers, timeout):
+    req = urllib.request.Request(url, data=data, headers=headers, method=method)
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            return response.status, response.reason, response.headers, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.reason, e.headers, e.read()
+
+
+async def _aread_chunked(reader):
+    chunks = []
+    while True:
+        size = int((await reader.readline()).split(b';', 1)[0].strip(), 16)
+        if size == 0:
+            # skip trailers
+            while (await reader.readline()).strip():
+                pass
+            return b''.join(chunks)
+        chunks.append(await reader.readexactly(size))
+        await reader.readline()
+
+
 def uid(namespace=None, length=None):
     the_uid = ShortUUID().uuid(namespace, length)
     return the_uid
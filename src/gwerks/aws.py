@@ -1,40 +1,282 @@
+import os
 import re
+import copy
+import contextvars
 import base64
 import string
+import threading
 from ast import literal_eval
-from time import time, sleep
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from time import time
+from types import MappingProxyType
 
 import boto3
+import smart_open
+from botocore.config import Config
 from botocore.exceptions import ClientError
-from tenacity import stop_after_attempt, wait_fixed, retry_if_exception_type, retry
 
-from gwerks import environment, region, is_live_environment, is_dev_environment, ENV_KEY
+from gwerks import environment, region, is_live_environment, is_dev_environment, on_profile_change
+from gwerks import ENV_KEY, PRO_KEY, PRO_DEFAULT
 
 from gwerks.util import Colors
+from gwerks.util.wait import Backoff, NotReady, WaitTimeout, poll, sleep
 
 
 # --------------------------------------------------------------------------- #
-# returns the current aws credentials
-def get_credentials():
-    session = boto3.Session()
-    credentials = session.get_credentials()
-    return credentials.access_key, credentials.secret_key
+# Process-wide pool of boto3 sessions, clients and resources.  Building a
+# client loads the botocore service model and opens a new connection pool, so
+# they are created once per (service, region, profile, environment) and reused.
+# Clients are thread-safe and shared by all threads, resources are not and are
+# cached per thread.
+class ClientPool:
+
+    def __init__(self, max_pool_connections=50):
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self._generation = 0
+        self._sessions = {}
+        self._clients = {}
+        self._config = Config(tcp_keepalive=True, max_pool_connections=max_pool_connections)
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # --------------------------------------------------------------------------- #
+    # returns the cached session for the profile, creating it if necessary
+    def session(self, profile_name=None):
+        current_profile = os.environ.get(PRO_KEY, PRO_DEFAULT)
+        if profile_name is None:
+            profile_name = current_profile
+        with self._lock:
+            the_session = self._sessions.get(profile_name)
+            if the_session is None:
+                # let boto3 resolve the current profile itself so env var credentials keep working
+                if profile_name == current_profile:
+                    the_session = boto3.session.Session()
+                else:
+                    the_session = boto3.session.Session(profile_name=profile_name)
+                self._sessions[profile_name] = the_session
+            return the_session
+
+    # --------------------------------------------------------------------------- #
+    # returns the cached client for the service, creating it if necessary
+    def client(self, service_name, region_name=None):
+        key = self._key(service_name, region_name)
+        the_client = self._clients.get(key)
+        if the_client is not None:
+            self._count(hit=True)
+            return the_client
+        with self._lock:
+            the_client = self._clients.get(key)
+            if the_client is None:
+                self._count(hit=False)
+                the_client = self.session(key[2]).client(service_name, region_name=region_name,
+                                                         config=self._config)
+                self._clients[key] = the_client
+            else:
+                self._count(hit=True)
+            return the_client
+
+    # --------------------------------------------------------------------------- #
+    # returns this thread's cached resource for the service, creating it if necessary
+    def resource(self, service_name, region_name=None):
+        key = self._key(service_name, region_name)
+        if getattr(self._local, "generation", None) != self._generation:
+            self._local.generation = self._generation
+            self._local.resources = {}
+        the_resource = self._local.resources.get(key)
+        if the_resource is not None:
+            self._count(hit=True)
+            return the_resource
+        self._count(hit=False)
+        # boto3 sessions aren't thread-safe, create it under the lock like clients
+        with self._lock:
+            the_resource = self.session(key[2]).resource(service_name, region_name=region_name,
+                                                         config=self._config)
+        self._local.resources[key] = the_resource
+        return the_resource
+
+    # --------------------------------------------------------------------------- #
+    # drops cached sessions, clients and resources.  With no arguments everything
+    # is dropped, otherwise only the entries for the given profile and/or region
+    def invalidate(self, profile_name=None, region_name=None):
+        with self._lock:
+            if profile_name is None and region_name is None:
+                self._sessions.clear()
+                self._clients.clear()
+            else:
+                for key in list(self._clients):
+                    if profile_name is not None and key[2] != profile_name:
+                        continue
+                    if region_name is not None and key[1] != region_name:
+                        continue
+                    del self._clients[key]
+                if profile_name is not None:
+                    self._sessions.pop(profile_name, None)
+            self._generation += 1
+
+    def stats(self):
+        with self._lock, self._stats_lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "sessions": len(self._sessions),
+                "clients": len(self._clients),
+            }
+
+    def _count(self, hit):
+        with self._stats_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    @staticmethod
+    def _key(service_name, region_name):
+        return service_name, region_name, os.environ.get(PRO_KEY, PRO_DEFAULT), environment()
+
+
+_client_pool = ClientPool()
+
+
+def get_session(profile_name=None):
+    return _client_pool.session(profile_name)
+
+
+def get_client(service_name, region_name=None):
+    return _client_pool.client(service_name, region_name)
+
+
+def get_resource(service_name, region_name=None):
+    return _client_pool.resource(service_name, region_name)
+
+
+def client_pool_stats():
+    return _client_pool.stats()
+
+
+def invalidate_clients(profile_name=None, region_name=None):
+    _client_pool.invalidate(profile_name, region_name)
+
+
+# --------------------------------------------------------------------------- #
+# Resolves credentials once per profile from the pooled session and shares
+# them with every caller.  Temporary credentials (SSO, assumed roles, instance
+# metadata) are refreshed by a background thread that touches them every
+# `check_interval` seconds; botocore renews them once they get within its
+# advisory window of expiry, so callers never block on the refresh.
+class CredentialProvider:
+
+    def __init__(self, check_interval=60):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._credentials = {}
+        self._refresher = None
+
+    # --------------------------------------------------------------------------- #
+    # returns (access_key, secret_key, token), token is None for long-lived keys
+    def get(self, profile_name=None):
+        if profile_name is None:
+            profile_name = os.environ.get(PRO_KEY, PRO_DEFAULT)
+        credentials = self._credentials.get(profile_name)
+        if credentials is None:
+            with self._lock:
+                credentials = self._credentials.get(profile_name)
+                if credentials is None:
+                    credentials = get_session(profile_name).get_credentials()
+                    if credentials is None:
+                        raise Exception(f"No AWS credentials found for profile '{profile_name}'")
+                    self._credentials[profile_name] = credentials
+                    if hasattr(credentials, 'refresh_needed'):
+                        self._start_refresher()
+        frozen = credentials.get_frozen_credentials()
+        return frozen.access_key, frozen.secret_key, frozen.token
+
+    def invalidate(self, profile_name=None):
+        with self._lock:
+            if profile_name is None:
+                self._credentials.clear()
+            else:
+                self._credentials.pop(profile_name, None)
+
+    def _start_refresher(self):
+        if self._refresher is None or not self._refresher.is_alive():
+            self._refresher = threading.Thread(target=self._refresh_loop, name="gwerks-credentials", daemon=True)
+            self._refresher.start()
+
+    def _refresh_loop(self):
+        while True:
+            sleep(self.check_interval)
+            with self._lock:
+                refreshable = [c for c in self._credentials.values() if hasattr(c, 'refresh_needed')]
+            for credentials in refreshable:
+                try:
+                    credentials.get_frozen_credentials()
+                except Exception as e:
+                    print(f"WARN: unable to refresh AWS credentials: {e}")
+
+
+_credential_provider = CredentialProvider()
+
+
+# drop the old profile's sessions, clients and credentials whenever gwerks.profile() changes it
+def _profile_changed(old_profile, new_profile):
+    invalidate_clients(profile_name=old_profile)
+    _credential_provider.invalidate(old_profile)
+
+
+on_profile_change(_profile_changed)
+
+
+# --------------------------------------------------------------------------- #
+# returns the current aws credentials as (access_key, secret_key), or with
+# include_token=True as (access_key, secret_key, session_token)
+def get_credentials(include_token=False):
+    access_key, secret_key, token = _credential_provider.get()
+    if include_token:
+        return access_key, secret_key, token
+    return access_key, secret_key
+
+
+# --------------------------------------------------------------------------- #
+# AWS Secrets Manager.  Decoded values are cached in-process (see SecretCache)
+# so repeated lookups on request paths don't call Secrets Manager each time.
+def get_secret(secret_name, region_name=None, version_id=None, version_stage=None, use_cache=True):
+    if not use_cache:
+        return copy.deepcopy(_fetch_secret(secret_name, region_name, version_id, version_stage)[0])
+    return _secret_cache.get(secret_name, region_name, version_id, version_stage)
+
+
+# --------------------------------------------------------------------------- #
+# Warms the cache for many secrets with batch_get_secret_value (20 per call)
+# and returns {secret_name: value}.  Secrets that don't exist are left out (and
+# negatively cached), any other error raises.
+def get_secrets(secret_names, region_name=None):
+    return _secret_cache.get_many(secret_names, region_name)
+
+
+# --------------------------------------------------------------------------- #
+# drops cached secret values, all of them or just those for secret_name
+def invalidate_secret(secret_name=None):
+    _secret_cache.invalidate(secret_name)
 
 
 # --------------------------------------------------------------------------- #
-# AWS Secrets Manager
-def get_secret(secret_name, region_name=None):
+# Returns (decoded value, VersionId) for the secret version.  Errors with
+# codes other than the ones below are swallowed and (None, None) returned.
+def _fetch_secret(secret_name, region_name=None, version_id=None, version_stage=None):
+
+    client = get_client('secretsmanager', region_name)
 
-    session = boto3.session.Session()
-    client = session.client(
-        service_name='secretsmanager',
-        region_name=region_name
-    )
+    kwargs = {'SecretId': secret_name}
+    if version_id:
+        kwargs['VersionId'] = version_id
+    if version_stage:
+        kwargs['VersionStage'] = version_stage
 
     try:
-        get_secret_value_response = client.get_secret_value(
-            SecretId=secret_name
-        )
+        get_secret_value_response = client.get_secret_value(**kwargs)
     except ClientError as e:
         if e.response['Error']['Code'] == 'DecryptionFailureException':
             # Secrets Manager can't decrypt the protected secret text using the provided KMS key.
@@ -51,24 +293,229 @@ def get_secret(secret_name, region_name=None):
         elif e.response['Error']['Code'] == 'ResourceNotFoundException':
             # AWS can't find the resource that you asked for.
             raise e
+        return None, None
     else:
-        # Decrypts secret using the associated KMS CMK.
-        # Depending on whether the secret is a string or binary, one of these fields will be populated.
-        if 'SecretString' in get_secret_value_response:
-            secret = get_secret_value_response['SecretString']
-            return literal_eval(secret)
+        return _decode_secret(get_secret_value_response), get_secret_value_response.get('VersionId')
+
+
+def _decode_secret(get_secret_value_response):
+    # Decrypts secret using the associated KMS CMK.
+    # Depending on whether the secret is a string or binary, one of these fields will be populated.
+    if 'SecretString' in get_secret_value_response:
+        secret = get_secret_value_response['SecretString']
+        return literal_eval(secret)
+    else:
+        code = get_secret_value_response['SecretBinary']
+
+        b64_altchars = b'+/'
+        b64_data = re.sub(rb'[^a-zA-Z0-9%s]+' % b64_altchars, b'', code)
+        missing_padding = len(b64_data) % 4
+        if missing_padding:
+            b64_data += b'=' * (4 - missing_padding)
+        decoded_binary_secret = base64.b64decode(b64_data, b64_altchars)
+        # decoded_binary_secret = _decode_base64(code)
+
+        return decoded_binary_secret
+
+
+# --------------------------------------------------------------------------- #
+# TTL cache of decoded secrets keyed by (name, region, version id, version
+# stage, profile).  A specific VersionId never changes so those entries don't
+# expire; stage lookups (AWSCURRENT by default) expire after `ttl` seconds so
+# rotations are picked up.  ResourceNotFound is remembered for `not_found_ttl`
+# seconds.  Callers get a copy of the value so they can't mutate the cache.
+class SecretCache:
+
+    BATCH_SIZE = 20
+
+    def __init__(self, ttl=300, not_found_ttl=30):
+        self.ttl = ttl
+        self.not_found_ttl = not_found_ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def get(self, secret_name, region_name=None, version_id=None, version_stage=None):
+        key = self._key(secret_name, region_name, version_id, version_stage)
+        entry = self._lookup(key)
+        if entry is None:
+            try:
+                value, found_version_id = _fetch_secret(secret_name, region_name, version_id, version_stage)
+            except ClientError as e:
+                if e.response['Error']['Code'] == 'ResourceNotFoundException':
+                    self._store(key, None, None, e)
+                raise e
+            if value is None:
+                return None
+            entry = self._store(key, value, found_version_id, None)
+        return self._value(entry)
+
+    def get_many(self, secret_names, region_name=None):
+        found = {}
+        to_fetch = []
+        for secret_name in secret_names:
+            entry = self._lookup(self._key(secret_name, region_name, None, None))
+            if entry is None:
+                to_fetch.append(secret_name)
+            elif entry[3] is None:
+                found[secret_name] = self._value(entry)
+
+        client = get_client('secretsmanager', region_name)
+        errors = []
+        for n in range(0, len(to_fetch), SecretCache.BATCH_SIZE):
+            batch = to_fetch[n:n + SecretCache.BATCH_SIZE]
+            response = {'NextToken': None}
+            while 'NextToken' in response:
+                kwargs = {'SecretIdList': batch}
+                if response['NextToken']:
+                    kwargs['NextToken'] = response['NextToken']
+                response = client.batch_get_secret_value(**kwargs)
+                for secret_value in response['SecretValues']:
+                    # the id asked for may have been the name or the ARN
+                    for secret_name in batch:
+                        if secret_name in (secret_value.get('Name'), secret_value.get('ARN')):
+                            entry = self._store(self._key(secret_name, region_name, None, None),
+                                                _decode_secret(secret_value), secret_value.get('VersionId'), None)
+                            found[secret_name] = self._value(entry)
+                for error in response.get('Errors', []):
+                    if error['ErrorCode'] == 'ResourceNotFoundException':
+                        exc = ClientError({'Error': {'Code': error['ErrorCode'], 'Message': error.get('Message')}},
+                                          'GetSecretValue')
+                        self._store(self._key(error['SecretId'], region_name, None, None), None, None, exc)
+                    else:
+                        errors.append(error)
+        if errors:
+            raise Exception(f"Unable to get secrets: {errors}")
+        return found
+
+    def invalidate(self, secret_name=None):
+        with self._lock:
+            if secret_name is None:
+                self._entries.clear()
+            else:
+                for key in [k for k in self._entries if k[0] == secret_name]:
+                    del self._entries[key]
+
+    # --------------------------------------------------------------------------- #
+    # entries are (expires, value, version_id, exception)
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] is not None and entry[0] <= time():
+                del self._entries[key]
+                entry = None
+            return entry
+
+    def _store(self, key, value, version_id, exc):
+        if exc is not None:
+            expires = time() + self.not_found_ttl
+        elif key[2] is not None:
+            expires = None
         else:
-            code = get_secret_value_response['SecretBinary']
+            expires = time() + self.ttl
+        entry = (expires, value, version_id, exc)
+        with self._lock:
+            self._entries[key] = entry
+        return entry
+
+    @staticmethod
+    def _value(entry):
+        if entry[3] is not None:
+            raise entry[3]
+        return copy.deepcopy(entry[1])
+
+    @staticmethod
+    def _key(secret_name, region_name, version_id, version_stage):
+        if version_id is None and version_stage is None:
+            version_stage = 'AWSCURRENT'
+        return secret_name, region_name, version_id, version_stage, os.environ.get(PRO_KEY, PRO_DEFAULT)
+
+
+_secret_cache = SecretCache()
+
+
+# --------------------------------------------------------------------------- #
+# SSM Parameter Store.  Returns the shared ParameterConfig for the path, which
+# defaults to /<environment> (e.g. /Dev) in the current region.
+def get_parameters(path=None, region_name=None, ttl=300):
+    if path is None:
+        path = f"/{environment()}"
+    if region_name is None:
+        region_name = region()
+    key = (path, region_name, os.environ.get(PRO_KEY, PRO_DEFAULT))
+    with _parameter_configs_lock:
+        if key not in _parameter_configs:
+            _parameter_configs[key] = ParameterConfig(path, region_name, ttl)
+        return _parameter_configs[key]
+
+
+# --------------------------------------------------------------------------- #
+# Read-only mapping of every parameter under a path, keyed relative to the
+# path ("/Dev/db/host" under "/Dev" is "db/host").  The whole path is loaded
+# with paginated get_parameters_by_path (SecureStrings decrypted) on first use.
+# Once `ttl` seconds pass, reads keep returning the current values while one
+# background thread reloads them.
+class ParameterConfig(Mapping):
+
+    def __init__(self, path, region_name=None, ttl=300):
+        self.path = path.rstrip("/") or "/"
+        self.region_name = region_name
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._values = None
+        self._loaded_at = None
+        self._refreshing = False
+
+    # --------------------------------------------------------------------------- #
+    # reloads all values now
+    def refresh(self):
+        ssm_client = get_client('ssm', self.region_name)
+        paginator = ssm_client.get_paginator('get_parameters_by_path')
+        prefix = self.path if self.path.endswith("/") else self.path + "/"
+        values = {}
+        for page in paginator.paginate(Path=self.path, Recursive=True, WithDecryption=True):
+            for parameter in page['Parameters']:
+                name = parameter['Name']
+                if name.startswith(prefix):
+                    name = name[len(prefix):]
+                values[name] = parameter['Value']
+        with self._lock:
+            self._values = MappingProxyType(values)
+            self._loaded_at = time()
+        return self._values
+
+    def _current(self):
+        with self._lock:
+            values = self._values
+            stale = values is not None and time() - self._loaded_at >= self.ttl and not self._refreshing
+            if stale:
+                self._refreshing = True
+        if values is None:
+            return self.refresh()
+        if stale:
+            threading.Thread(target=self._background_refresh, name="gwerks-parameters", daemon=True).start()
+        return values
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            print(f"WARN: unable to refresh parameters under {self.path}: {e}")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def __getitem__(self, key):
+        return self._current()[key]
+
+    def __iter__(self):
+        return iter(self._current())
+
+    def __len__(self):
+        return len(self._current())
 
-            b64_altchars = b'+/'
-            b64_data = re.sub(rb'[^a-zA-Z0-9%s]+' % b64_altchars, b'', code)
-            missing_padding = len(b64_data) % 4
-            if missing_padding:
-                b64_data += b'=' * (4 - missing_padding)
-            decoded_binary_secret = base64.b64decode(b64_data, b64_altchars)
-            # decoded_binary_secret = _decode_base64(code)
 
-            return decoded_binary_secret
+_parameter_configs_lock = threading.Lock()
+_parameter_configs = {}
 
 
 # --------------------------------------------------------------------------- #
@@ -202,7 +649,7 @@ class SpecHelper:
 
     def get_elastic_ip_from_pool(self, region_name):
         pool_name = self.get('elastic_ip_from_pool')
-        ec2_client = boto3.client('ec2', region_name=region_name)
+        ec2_client = get_client('ec2', region_name)
         response = ec2_client.describe_addresses(
             Filters=[{'Name': 'tag:eip-pool', 'Values': [pool_name]}]
         )
@@ -311,7 +758,7 @@ class Instance:
     # Binds to the instance for the name and environment_name.  Creates it if necessary.
     def __init__(self, name, region_name=None, spec: SpecHelper = None, bootstrapper: Bootstrap = None):
 
-        self.name = Instance._full_name(name)
+        self.name = Instance._full_name_for(name)
         self.environment_name = environment()
 
         if region_name:
@@ -319,7 +766,7 @@ class Instance:
         else:
             self.region_name = region()
 
-        self._keypair_name = spec.get_key_pair_name()
+        self._keypair_name = spec.get_key_pair_name() if spec is not None else None
 
         self.instance = None
 
@@ -362,12 +809,22 @@ class Instance:
     def configure(self, commands):
         raise Exception("not implemented!")
 
+    # --------------------------------------------------------------------------- #
+    # Configure this machine, yielding output lines while the commands run
+    def configure_stream(self, commands):
+        raise Exception("not implemented!")
+
     # --------------------------------------------------------------------------- #
     # runs the specified commands and interrogates the output for the
-    # specified string
-    def configure_and_verify(self, commands, validation_string):
+    # specified string.  With stream=True the output is read as it is produced
+    # and this returns as soon as the string shows up.
+    def configure_and_verify(self, commands, validation_string, stream=False):
         verified = False
-        for line in self.configure(commands):
+        if stream:
+            lines = self.configure_stream(commands)
+        else:
+            lines = self.configure(commands) or []
+        for line in lines:
             # print(line)
             if validation_string in line:
                 verified = True
@@ -401,7 +858,7 @@ class Instance:
             print("Spot instances cannot be protected from accidental termination.")
             return
         toggle_to = not self.is_termination_protected()
-        ec2_client = boto3.client('ec2', region_name=self.region_name)
+        ec2_client = get_client('ec2', self.region_name)
         ec2_client.modify_instance_attribute(
             InstanceId=self.instance_id,
             Attribute="disableApiTermination",
@@ -421,7 +878,7 @@ class Instance:
     # --------------------------------------------------------------------------- #
     # Returns True if the machine has termination protection enabled
     def is_termination_protected(self):
-        ec2_client = boto3.client('ec2', region_name=self.region_name)
+        ec2_client = get_client('ec2', self.region_name)
         response = ec2_client.describe_instance_attribute(
             Attribute='disableApiTermination',
             InstanceId=self.instance_id
@@ -440,7 +897,7 @@ class Instance:
     # --------------------------------------------------------------------------- #
     # Sets all of the specified tags
     def apply_tags(self, tags):
-        ec2_resource = boto3.resource('ec2', region_name=self.region_name)
+        ec2_resource = get_resource('ec2', self.region_name)
         inst = ec2_resource.Instance(self.instance_id)
         inst.create_tags(Tags=tags)
 
@@ -451,7 +908,7 @@ class Instance:
         print(f'Associating {Colors.grn}{self.name}{Colors.end} ({self.instance_id}) with {elastic_ip}')
         # # allocation = ec2_client.allocate_address(Domain='vpc')
         allocation_id = None
-        ec2_client = boto3.client('ec2', region_name=self.region_name)
+        ec2_client = get_client('ec2', self.region_name)
         addresses_dict = ec2_client.describe_addresses()
         for eip_dict in addresses_dict['Addresses']:
             if "InstanceId" in eip_dict:
@@ -487,7 +944,7 @@ class Instance:
 
             # disable termination protection if not a spot instance
             if 'SpotInstanceRequestId' not in instance:
-                ec2_client = boto3.client('ec2', region_name=self.region_name)
+                ec2_client = get_client('ec2', self.region_name)
                 # response = ec2_client.describe_instance_attribute(
                 #     Attribute='disableApiTermination',
                 #     InstanceId=instance['InstanceId']
@@ -501,7 +958,7 @@ class Instance:
 
             print(f'Terminating {Colors.grn}{self.name}{Colors.end} '
                   f'in the {Colors.grn}{environment()}{Colors.end} environment_name...')
-            ec2_resource = boto3.resource('ec2', region_name=self.region_name)
+            ec2_resource = get_resource('ec2', self.region_name)
             instance = ec2_resource.Instance(instance['InstanceId'])
             instance.terminate()
 
@@ -535,7 +992,7 @@ class Instance:
 
             print(f'Stopping {Colors.grn}{self.name}{Colors.end} '
                   f'in the {Colors.grn}{environment()}{Colors.end} environment_name...', end='', flush=True)
-            ec2_client = boto3.client('ec2', region_name=self.region_name)
+            ec2_client = get_client('ec2', self.region_name)
             ec2_client.stop_instances(InstanceIds=[instance['InstanceId']], DryRun=False)
             print(f'Done.')
 
@@ -563,7 +1020,7 @@ class Instance:
 
             print(f'Starting {Colors.grn}{instance_name}{Colors.end} '
                   f'in the {Colors.grn}{environment()}{Colors.end} environment_name...', end='', flush=True)
-            ec2_client = boto3.client('ec2', region_name=self.region_name)
+            ec2_client = get_client('ec2', self.region_name)
             ec2_client.start_instances(InstanceIds=[instance['InstanceId']], DryRun=False)
             print(f'Done.')
 
@@ -577,7 +1034,10 @@ class Instance:
     # --------------------------------------------------------------------------- #
     # logic for creating machine names
     def _full_name(self):
-        raw_name = self.name
+        return Instance._full_name_for(self.name)
+
+    @staticmethod
+    def _full_name_for(raw_name):
         name = "".join([c for c in raw_name if c in string.ascii_letters or c in string.digits or c in '-_'])
         env = environment()
         if not is_live_environment():
@@ -585,39 +1045,49 @@ class Instance:
         return name
 
     # --------------------------------------------------------------------------- #
-    # Finds a machine instance for the specified name
-    def _find(self, normalize_name=True):
-        m_name = self.name
-        if normalize_name:
-            instance_name = [self._full_name()]
-        else:
-            instance_name = [m_name]
-
+    # the Name and Environment tag values a machine may be found under
+    @staticmethod
+    def _tag_values(full_name):
+        instance_name = [full_name]
         environment_list = [environment()]
         if is_dev_environment():
             environment_list.append("Development")
             instance_name.append(f"{instance_name[0]}elopment")
+        return instance_name, environment_list
+
+    # --------------------------------------------------------------------------- #
+    # Finds a machine instance for the specified name
+    def _find(self, normalize_name=True):
+        if normalize_name:
+            instance_name, environment_list = Instance._tag_values(self._full_name())
+        else:
+            instance_name, environment_list = Instance._tag_values(self.name)
 
         # print(f"Looking for '{name}' in '{environment_name}'...")
 
-        ec2_client = boto3.client('ec2', region_name=self.region_name)
+        ec2_client = get_client('ec2', self.region_name)
         ec2_response = ec2_client.describe_instances(
             Filters=[
                 {'Name': 'tag:Name', 'Values': instance_name},
                 {'Name': 'tag:Environment', 'Values': environment_list},
             ],
         )
+        instances = [i for r in ec2_response['Reservations'] for i in r['Instances']]
+        return Instance._only_one(instances, instance_name, environment_list)
+
+    # --------------------------------------------------------------------------- #
+    # Returns the single live instance in the list, or None if there isn't one
+    @staticmethod
+    def _only_one(instances, instance_name, environment_list):
         found_instance = None
-        if len(ec2_response['Reservations']) > 0:
-            for r in ec2_response['Reservations']:
-                for i in r['Instances']:
-                    state = i['State']['Name']
-                    if state != "terminated" and state != 'shutting-down':
-                        if found_instance is not None:
-                            # Highlander pattern, there can be only be one
-                            raise Exception(f'Found more than one machine for {instance_name} + {environment_list}')
-                        else:
-                            found_instance = i
+        for i in instances:
+            state = i['State']['Name']
+            if state != "terminated" and state != 'shutting-down':
+                if found_instance is not None:
+                    # Highlander pattern, there can be only be one
+                    raise Exception(f'Found more than one machine for {instance_name} + {environment_list}')
+                else:
+                    found_instance = i
         return found_instance
 
     # --------------------------------------------------------------------------- #
@@ -625,62 +1095,93 @@ class Instance:
     def _bind(self):
         i = self._find(False)
         if i is not None:
-            self.instance = i
-            self.instance_id = i['InstanceId']
-
-            self.availability_zone = i['Placement']['AvailabilityZone']
-
-            # get the ip address(es)
-            self.host_ip_v4_private = None
-            self.host_ip_v4_public = None
-            self.host_ip_v4_elastic = None
-            if "PrivateIpAddress" in i:
-                self.host_ip_v4_private = i["PrivateIpAddress"]
-            if "PublicIpAddress" in i:
-                self.host_ip_v4_public = i["PublicIpAddress"]
-            ec2_client = boto3.client('ec2', region_name=self.region_name)
-            addresses_dict = ec2_client.describe_addresses()
-            for eip_dict in addresses_dict['Addresses']:
-                if "InstanceId" in eip_dict and eip_dict["InstanceId"] == self.instance_id:
-                    self.host_ip_v4_elastic = eip_dict["PublicIp"]
-                    break
-            # if self.host_ip_v4_elastic:
-            #     self.host_ip_v4 = self.host_ip_v4_elastic
-            #     self.host_ip_v4_type = "elastic"
-            # elif self.host_ip_v4_public:
-            #     self.host_ip_v4 = self.host_ip_v4_public
-            #     self.host_ip_v4_type = "public"
-            # else:
-            self.host_ip_v4 = self.host_ip_v4_private
-            self.host_ip_v4_type = "private"
-
-            if "KeyName" in i:
-                self.key_name = i['KeyName']
-            else:
-                self.key_name = "Unknown"
-
-            if "Platform" in i:
-                self.platform = i['Platform']
-
-            # set the timestamp and name from the tags
-            ts = None
-            for tag in i['Tags']:
-                if tag['Key'] == 'Timestamp':
-                    ts = tag['Value']
-                if tag['Key'] == 'Name':
-                    self.name = tag['Value']
-            if ts is not None:
-                self._timestamp = ts
-            # else:
-            #     raise Exception(f'Machine {self.name_env()} does not have a Timestamp tag, unable to bind')
+            ec2_client = get_client('ec2', self.region_name)
+            addresses_dict = ec2_client.describe_addresses(
+                Filters=[{'Name': 'instance-id', 'Values': [i['InstanceId']]}]
+            )
+            self._bind_to(i, addresses_dict['Addresses'])
         else:
             raise InstanceNotFound(f'Machine {self.name} not found, unable to bind')
 
+    # --------------------------------------------------------------------------- #
+    # Sets this object's attributes from an instance description and the
+    # Elastic IP address descriptions that may be associated with it
+    def _bind_to(self, i, addresses):
+        self.instance = i
+        self.instance_id = i['InstanceId']
+
+        self.availability_zone = i['Placement']['AvailabilityZone']
+
+        # get the ip address(es)
+        self.host_ip_v4_private = None
+        self.host_ip_v4_public = None
+        self.host_ip_v4_elastic = None
+        if "PrivateIpAddress" in i:
+            self.host_ip_v4_private = i["PrivateIpAddress"]
+        if "PublicIpAddress" in i:
+            self.host_ip_v4_public = i["PublicIpAddress"]
+        for eip_dict in addresses:
+            if "InstanceId" in eip_dict and eip_dict["InstanceId"] == self.instance_id:
+                self.host_ip_v4_elastic = eip_dict["PublicIp"]
+                break
+        # if self.host_ip_v4_elastic:
+        #     self.host_ip_v4 = self.host_ip_v4_elastic
+        #     self.host_ip_v4_type = "elastic"
+        # elif self.host_ip_v4_public:
+        #     self.host_ip_v4 = self.host_ip_v4_public
+        #     self.host_ip_v4_type = "public"
+        # else:
+        self.host_ip_v4 = self.host_ip_v4_private
+        self.host_ip_v4_type = "private"
+
+        if "KeyName" in i:
+            self.key_name = i['KeyName']
+        else:
+            self.key_name = "Unknown"
+
+        if "Platform" in i:
+            self.platform = i['Platform']
+
+        # set the timestamp and name from the tags
+        ts = None
+        for tag in i['Tags']:
+            if tag['Key'] == 'Timestamp':
+                ts = tag['Value']
+            if tag['Key'] == 'Name':
+                self.name = tag['Value']
+        if ts is not None:
+            self._timestamp = ts
+        # else:
+        #     raise Exception(f'Machine {self.name_env()} does not have a Timestamp tag, unable to bind')
+
+    # --------------------------------------------------------------------------- #
+    # Creates a bound object from descriptions that were already fetched,
+    # without the lookups and readiness checks __init__ does.  Like __init__,
+    # the key pair guarding terminate/stop/start comes from the spec, if any.
+    @classmethod
+    def _from_description(cls, name, region_name, i, addresses, spec: SpecHelper = None):
+        bound = cls.__new__(cls)
+        bound.name = name
+        bound.environment_name = environment()
+        bound.region_name = region_name
+        bound._keypair_name = spec.get_key_pair_name() if spec is not None else None
+        bound.instance = None
+        bound._bind_to(i, addresses)
+        return bound
+
+    # --------------------------------------------------------------------------- #
+    # Binds to many existing machines at once, see Fleet.bind
+    @classmethod
+    def bind_many(cls, names, region_name=None, strict=True, spec: SpecHelper = None):
+        return Fleet(region_name, instance_class=cls).bind(names, strict=strict, spec=spec)
+
     # --------------------------------------------------------------------------- #
     # Launches a machine instance for the name, environment_name, and spec
     def _launch(self, machine_spec, bootstrapper):
 
-        spec = SpecHelper(machine_spec)
+        spec = machine_spec
+        if not isinstance(spec, SpecHelper):
+            spec = SpecHelper(spec)
         self.subnet = spec.get('subnet')
         self.subnet_id = spec.get_subnet()
         self.key_pair_name = spec.get_key_pair_name()
@@ -737,7 +1238,7 @@ class Instance:
             raise Exception(f'Unable to confirm {self.name} is ready, not safe to continue')
 
     def _launch_on_demand_instance(self, spec, bootstrapper):
-        ec2_resource = boto3.resource('ec2', region_name=self.region_name)
+        ec2_resource = get_resource('ec2', self.region_name)
         instance = ec2_resource.create_instances(
             ImageId=spec.get_ami(),
             InstanceType=spec.get('size'),
@@ -754,12 +1255,11 @@ class Instance:
               end='', flush=True)
 
         # waits until the instance is responsive
-        instance[0].wait_until_running()
-        print(f'Done.')
+        self._wait_until_running()
+        print('Done.')
 
     def _launch_spot_instance(self, spec, bootstrapper, wait_time=30, retries=60):
-        ec2_client = boto3.client('ec2', region_name=self.region_name)
-        ec2_resource = boto3.resource('ec2', region_name=self.region_name)
+        ec2_client = get_client('ec2', self.region_name)
 
         # request spot instance
         print(f'Requesting a spot instance for {Colors.grn}{self.name}{Colors.end}... ', end='')
@@ -779,22 +1279,45 @@ class Instance:
 
         # wait for request to be fulfilled
         print(f'Getting instance id for {Colors.grn}{self.name}{Colors.end}... ', end='')
-        while self.instance_id is None and retries > 0:
-            sleep(wait_time)
-            ec2_response = ec2_client.describe_spot_instance_requests(SpotInstanceRequestIds=[spot_request_id])
-            self._parse_spot_instance_requests(ec2_response)
+
+        def fulfilled():
+            self._parse_spot_instance_requests(
+                ec2_client.describe_spot_instance_requests(SpotInstanceRequestIds=[spot_request_id]))
             if self.instance_id is None:
-                print(f'Spot request not fulfilled yet, retrying in {wait_time} seconds, {retries} retries left...')
-                retries -= 1
+                print('Spot request not fulfilled yet, retrying...')
+                raise NotReady(spot_request_id)
+            return self.instance_id
+
         if self.instance_id is None:
-            raise Exception(f'Unable to fulfill spot request for {Colors.grn}{self.name}{Colors.end}')
+            try:
+                poll(fulfilled, Backoff(first=2, initial=5, factor=1.5, maximum=wait_time, attempts=retries),
+                     phase="spot_request")
+            except WaitTimeout:
+                raise Exception(f'Unable to fulfill spot request for {Colors.grn}{self.name}{Colors.end}')
         print(self.instance_id)
 
         # wait until the instance is running
-        instance = ec2_resource.Instance(self.instance_id)
-        instance.wait_until_running()
+        self._wait_until_running()
         print(f'Spot request for {Colors.grn}{self.name}{Colors.end} fulfilled and running.')
 
+    # --------------------------------------------------------------------------- #
+    # Polls until the instance reaches the running state
+    def _wait_until_running(self, timeout=600):
+        ec2_client = get_client('ec2', self.region_name)
+
+        def running():
+            response = ec2_client.describe_instances(InstanceIds=[self.instance_id])
+            state = response['Reservations'][0]['Instances'][0]['State']['Name']
+            if state == 'running':
+                return state
+            if state in ['shutting-down', 'terminated', 'stopping', 'stopped']:
+                raise Exception(f'{self.instance_id} entered the {state} state while waiting for it to run')
+            raise NotReady(state)
+
+        # describe_instances can briefly fail with InvalidInstanceID.NotFound right after launch
+        poll(running, Backoff(first=1, initial=2, factor=1.5, maximum=15, timeout=timeout),
+             phase="wait_until_running", retry_on=(ClientError,))
+
     def _parse_spot_instance_requests(self, ec2_response):
         spot_request_id = None
         spot_requests = ec2_response['SpotInstanceRequests']
@@ -813,6 +1336,234 @@ class Instance:
         return spot_request_id
 
 
+# --------------------------------------------------------------------------- #
+# Binds to many machines in the current environment at once.  All of the
+# environment's instances are fetched with one paginated, tag-filtered
+# describe_instances and all Elastic IPs with one describe_addresses, then
+# joined in memory, instead of two API calls per machine.
+class Fleet:
+
+    LIVE_STATES = ['pending', 'running', 'stopping', 'stopped']
+
+    # send_command accepts at most 50 instance ids per call
+    SSM_MAX_TARGETS = 50
+
+    def __init__(self, region_name=None, instance_class=None):
+        if region_name:
+            self.region_name = region_name
+        else:
+            self.region_name = region()
+        if instance_class is None:
+            instance_class = Instance
+        self.instance_class = instance_class
+
+    # --------------------------------------------------------------------------- #
+    # Returns {name: Instance} for the given (un-normalized) machine names.  With
+    # strict=True an InstanceNotFound is raised if any of them doesn't exist,
+    # otherwise missing machines are left out of the result.  spec, as for
+    # Instance(name, spec=...), gives the key pair the machines must have to be
+    # terminated, stopped or started without force.
+    def bind(self, names, strict=True, spec: SpecHelper = None):
+        by_name = self._describe_instances()
+        addresses = self._describe_addresses()
+
+        bound = {}
+        missing = []
+        for name in names:
+            instance_name, environment_list = Instance._tag_values(Instance._full_name_for(name))
+            candidates = [i for n in instance_name for i in by_name.get(n, [])]
+            i = Instance._only_one(candidates, instance_name, environment_list)
+            if i is None:
+                missing.append(name)
+                continue
+            bound[name] = self.instance_class._from_description(instance_name[0], self.region_name, i, addresses,
+                                                                spec)
+
+        if missing and strict:
+            raise InstanceNotFound(f'Machines {missing} not found in {environment()}, unable to bind')
+        return bound
+
+    # --------------------------------------------------------------------------- #
+    # Binds to or launches many machines concurrently.  Each entry is a
+    # (name, spec, bootstrapper) tuple (bootstrapper may be omitted) and runs the
+    # same bind/launch/readiness pipeline as instance_class(name, ...) on a pool
+    # of at most max_workers threads, so one slow spot request doesn't hold up
+    # the rest.  Returns ({name: Instance}, {name: Exception}); with
+    # raise_exc=True an Exception is raised after all entries finish if any failed.
+    def launch(self, entries, max_workers=8, raise_exc=True):
+        launched = {}
+        failures = {}
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gwerks-launch") as pool:
+            futures = {}
+            for entry in entries:
+                name, spec, bootstrapper = (tuple(entry) + (None,))[:3]
+                print(f'Queueing launch of {Colors.grn}{name}{Colors.end}')
+                # in a copy of this context so the workers' output keeps the emitter prefix
+                futures[pool.submit(contextvars.copy_context().run, self.instance_class, name, self.region_name,
+                                    spec, bootstrapper)] = name
+
+            for count, future in enumerate(as_completed(futures), start=1):
+                name = futures[future]
+                try:
+                    launched[name] = future.result()
+                    print(f'[{count}/{len(futures)}] {Colors.grn}{name}{Colors.end} is ready')
+                except Exception as e:
+                    failures[name] = e
+                    print(f'[{count}/{len(futures)}] {Colors.red}{name} failed: {e}{Colors.end}')
+
+        if failures and raise_exc:
+            raise Exception(f'Unable to launch {len(failures)} of {len(futures)} machines: '
+                            f'{ {name: str(e) for name, e in failures.items()} }')
+        return launched, failures
+
+    # --------------------------------------------------------------------------- #
+    # Sends the commands to many machines at once, in send_command batches of up
+    # to 50 instance ids, and polls their status in bulk with
+    # list_command_invocations.  `instances` is a {name: Instance} dict (as
+    # returned by bind) or a list of Instances.  Returns ({name: output lines or
+    # None}, {name: Exception}) for the machines that succeeded and failed.
+    def configure(self, instances, commands, execution_timeout=3600, print_commands=True, print_output=True):
+
+        if execution_timeout < 30:
+            raise Exception("'execution_timeout' must be set to at least 30 seconds")
+
+        if not isinstance(instances, dict):
+            instances = {i.name: i for i in instances}
+        names_by_id = {i.instance_id: name for name, i in instances.items()}
+
+        for cmd in commands:
+            if print_commands:
+                print(f'{Colors.cyn}#>{cmd}{Colors.end}')  # in cyan
+
+        ssm_client = get_client('ssm', self.region_name)
+        instance_ids = list(names_by_id)
+        pending = {}
+        for n in range(0, len(instance_ids), Fleet.SSM_MAX_TARGETS):
+            batch = instance_ids[n:n + Fleet.SSM_MAX_TARGETS]
+            response = ssm_client.send_command(
+                InstanceIds=batch,
+                DocumentName="AWS-RunShellScript",
+                Parameters={'commands': commands,
+                            'executionTimeout': [str(execution_timeout)]
+                            },
+            )
+            pending[response['Command']['CommandId']] = set(batch)
+
+        results = {}
+        failures = {}
+
+        def finished():
+            paginator = ssm_client.get_paginator('list_command_invocations')
+            for command_id, remaining in pending.items():
+                if not remaining:
+                    continue
+                for page in paginator.paginate(CommandId=command_id):
+                    for inv in page['CommandInvocations']:
+                        instance_id = inv['InstanceId']
+                        if instance_id not in remaining:
+                            continue
+                        name = names_by_id[instance_id]
+                        status = inv['StatusDetails']
+                        if status.lower() == 'success':
+                            # list_command_invocations truncates output, fetch it once per machine
+                            inv_resp = ssm_client.get_command_invocation(CommandId=command_id,
+                                                                         InstanceId=instance_id)
+                            print(f"{name} ({instance_id}): {Colors.grn}{status}{Colors.end}")
+                            results[name] = LinuxInstance._output_lines(inv_resp, print_output)
+                            remaining.discard(instance_id)
+                        elif status.lower() in LinuxInstance.SSM_FAILED_STATUSES:
+                            print(f"{name} ({instance_id}): {Colors.red}{status}{Colors.end}")
+                            failures[name] = Exception(f'Error processing command {command_id} '
+                                                       f'on instance {instance_id}: {status}')
+                            remaining.discard(instance_id)
+            in_progress = sum(len(remaining) for remaining in pending.values())
+            if in_progress:
+                raise NotReady(f"{in_progress} machines still running")
+
+        try:
+            poll(finished, Backoff(first=1, initial=2, factor=1.5, maximum=15, timeout=execution_timeout),
+                 phase="ssm_fleet_command")
+        except WaitTimeout as e:
+            for remaining in pending.values():
+                for instance_id in remaining:
+                    failures[names_by_id[instance_id]] = e
+
+        return results, failures
+
+    # --------------------------------------------------------------------------- #
+    # configure() followed by the Instance.configure_and_verify check on each
+    # machine's output, returns {name: True/False}
+    def configure_and_verify(self, instances, commands, validation_string, execution_timeout=3600):
+        results, failures = self.configure(instances, commands, execution_timeout=execution_timeout)
+        verified = {name: False for name in failures}
+        for name, lines in results.items():
+            verified[name] = any(validation_string in line for line in lines or [])
+        return verified
+
+    # --------------------------------------------------------------------------- #
+    # all live instances tagged with the current environment, grouped by Name tag
+    def _describe_instances(self):
+        environment_list = Instance._tag_values("")[1]
+        ec2_client = get_client('ec2', self.region_name)
+        paginator = ec2_client.get_paginator('describe_instances')
+        pages = paginator.paginate(
+            Filters=[
+                {'Name': 'tag:Environment', 'Values': environment_list},
+                {'Name': 'instance-state-name', 'Values': Fleet.LIVE_STATES},
+            ],
+        )
+        by_name = {}
+        for page in pages:
+            for r in page['Reservations']:
+                for i in r['Instances']:
+                    for tag in i.get('Tags', []):
+                        if tag['Key'] == 'Name':
+                            by_name.setdefault(tag['Value'], []).append(i)
+        return by_name
+
+    def _describe_addresses(self):
+        ec2_client = get_client('ec2', self.region_name)
+        return ec2_client.describe_addresses()['Addresses']
+
+
+# --------------------------------------------------------------------------- #
+# Reads new events from one CloudWatch Logs stream each time read() is called
+class _LogTail:
+
+    def __init__(self, region_name, log_group_name, log_stream_name, color=None):
+        self._region_name = region_name
+        self._log_group_name = log_group_name
+        self._log_stream_name = log_stream_name
+        self._color = color
+        self._token = None
+
+    def read(self):
+        logs_client = get_client('logs', self._region_name)
+        while True:
+            kwargs = {'logGroupName': self._log_group_name,
+                      'logStreamName': self._log_stream_name,
+                      'startFromHead': True}
+            if self._token:
+                kwargs['nextToken'] = self._token
+            try:
+                response = logs_client.get_log_events(**kwargs)
+            except ClientError as e:
+                if e.response['Error']['Code'] == 'ResourceNotFoundException':
+                    return  # the stream is created with the first line of output
+                raise e
+            for event in response['events']:
+                for line in event['message'].splitlines():
+                    if self._color:
+                        line = f"{self._color}{line}{Colors.end}"
+                    yield line
+            # the same token comes back once the end of the stream is reached
+            if response['nextForwardToken'] == self._token:
+                return
+            self._token = response['nextForwardToken']
+            if not response['events']:
+                return
+
+
 class InstanceNotFound(Exception):
     pass
 
@@ -825,13 +1576,40 @@ class LinuxInstance(Instance):
 
     TYPE = "linux-server"
 
-    def __init__(self, name):
-        super().__init__(name)
+    platform = "aws linux"
+
+    SSM_FAILED_STATUSES = [
+        'delivery timed out', 'execution timed out', 'failed', 'canceled', 'undeliverable', 'terminated',
+        'invalid platform', 'access denied'
+    ]
+
+    # where configure_stream sends command output
+    SSM_LOG_GROUP = "/gwerks/ssm"
+
+    # CloudWatch Logs ingestion lags the command, so after it finishes
+    # configure_stream keeps tailing for at least this many seconds and until
+    # this many reads in a row come back empty
+    SSM_LOG_DRAIN_SECONDS = 15
+    SSM_LOG_DRAIN_EMPTY_READS = 3
+
+    # output objects can land in S3 a moment after the command succeeds; after
+    # this many polls without them configure falls back to the inline output
+    SSM_S3_OUTPUT_ATTEMPTS = 3
+
+    # bootstrapping takes minutes, poll quickly at first then settle at 15s for up to 15 minutes
+    READY_BACKOFF = Backoff(first=0, initial=5, factor=1.5, maximum=15, timeout=900)
+
+    def __init__(self, name, region_name=None, spec: SpecHelper = None, bootstrapper: Bootstrap = None):
+        super().__init__(name, region_name, spec, bootstrapper)
         self.platform = "aws linux"
 
     # --------------------------------------------------------------------------- #
-    # Configure this machine by remotely sending commands to it
-    def configure(self, commands, execution_timeout=3600, print_commands=True, print_output=True):
+    # Configure this machine by remotely sending commands to it.  SSM truncates
+    # the output it returns inline at about 24KB; with output_s3_bucket set the
+    # complete output is written to s3://bucket/prefix/ instead and returned as
+    # a lazy line iterator that streams it back with smart_open.
+    def configure(self, commands, execution_timeout=3600, print_commands=True, print_output=True,
+                  output_s3_bucket=None, output_s3_prefix=None):
 
         if execution_timeout < 30:
             raise Exception("'execution_timeout' must be set to at least 30 seconds")
@@ -842,27 +1620,121 @@ class LinuxInstance(Instance):
             if print_commands:
                 print(f'{Colors.cyn}#>{cmd}{Colors.end}')  # in cyan
 
-        ssm_client = boto3.client('ssm', region_name=self.region_name)
+        output_s3 = None
+        send_kwargs = {}
+        if output_s3_bucket:
+            output_s3 = (output_s3_bucket, (output_s3_prefix or "").strip("/"))
+            send_kwargs['OutputS3BucketName'] = output_s3_bucket
+            if output_s3[1]:
+                send_kwargs['OutputS3KeyPrefix'] = output_s3[1]
+
+        ssm_client = get_client('ssm', self.region_name)
         response = ssm_client.send_command(
             InstanceIds=[self.instance_id],
             DocumentName="AWS-RunShellScript",
             Parameters={'commands': commands,
                         'executionTimeout': exec_timeout
                         },
+            **send_kwargs
         )
         # print(response)
         command_id = response['Command']['CommandId']
 
-        sleep(3)  # need to wait just a couple seconds for the command to register
+        # the first poll comes quickly, an unregistered command just reads as in progress
+        backoff = Backoff(first=1, initial=2, factor=1.5, maximum=15, timeout=execution_timeout)
+        s3_waits = {'attempts': 0}
+        return poll(lambda: self._ssm_status(command_id, print_output, output_s3, s3_waits), backoff,
+                    phase="ssm_command", retry_on=(CommandInProgressException,))
+
+    # --------------------------------------------------------------------------- #
+    # Configure this machine, yielding output lines as the commands produce them.
+    # The command's output is sent to CloudWatch Logs and its stdout/stderr log
+    # streams are tailed until the command finishes.  The instance role needs
+    # permission to write to log_group_name.  Raises once the output is drained
+    # if the command fails.
+    def configure_stream(self, commands, execution_timeout=3600, print_commands=True, print_output=True,
+                         log_group_name=None):
+
+        if execution_timeout < 30:
+            raise Exception("'execution_timeout' must be set to at least 30 seconds")
+        if log_group_name is None:
+            log_group_name = LinuxInstance.SSM_LOG_GROUP
+
+        for cmd in commands:
+            if print_commands:
+                print(f'{Colors.cyn}#>{cmd}{Colors.end}')  # in cyan
+
+        ssm_client = get_client('ssm', self.region_name)
+        response = ssm_client.send_command(
+            InstanceIds=[self.instance_id],
+            DocumentName="AWS-RunShellScript",
+            Parameters={'commands': commands,
+                        'executionTimeout': [str(execution_timeout)]
+                        },
+            CloudWatchOutputConfig={'CloudWatchLogGroupName': log_group_name,
+                                    'CloudWatchOutputEnabled': True},
+        )
+        command_id = response['Command']['CommandId']
+
+        stream_prefix = f"{command_id}/{self.instance_id}/aws-runShellScript"
+        tails = [_LogTail(self.region_name, log_group_name, f"{stream_prefix}/stdout", None),
+                 _LogTail(self.region_name, log_group_name, f"{stream_prefix}/stderr", Colors.red)]
+        backoff = Backoff(first=1, initial=1, factor=1.5, maximum=10)
+
+        start = time()
+        attempt = 0
+        status = None
+        finished = None
+        empty_reads = 0
+        while True:
+            got_output = False
+            for tail in tails:
+                for line in tail.read():
+                    got_output = True
+                    if print_output:
+                        print(f'{Colors.grn}{line.strip()}{Colors.end}')  # in green
+                    yield line
+
+            # once finished, keep draining until the logs stop arriving
+            if status is not None:
+                empty_reads = 0 if got_output else empty_reads + 1
+                if (empty_reads >= LinuxInstance.SSM_LOG_DRAIN_EMPTY_READS
+                        and time() - finished >= LinuxInstance.SSM_LOG_DRAIN_SECONDS):
+                    break
+            else:
+                status = self._ssm_status_nowait(command_id)
+                if status is not None:
+                    finished = time()
+                elif time() - start > execution_timeout:
+                    raise Exception(f'Timed out waiting on command {command_id} on instance {self.instance_id}')
 
-        num_status_retries = int(execution_timeout / 15)
-        return self._ssm_status.retry_with(stop=stop_after_attempt(num_status_retries),
-                                           wait=wait_fixed(15),
-                                           retry=retry_if_exception_type(CommandInProgressException))(command_id, print_output)
+            attempt = 1 if got_output else attempt + 1
+            sleep(backoff.delay(attempt))
 
-    @retry(stop=stop_after_attempt(240), wait=wait_fixed(15), retry=retry_if_exception_type(CommandInProgressException))
-    def _ssm_status(self, command_id, print_output=True):
-        ssm_client = boto3.client('ssm', region_name=self.region_name)
+        print(f"Command {command_id}: {Colors.grn if status.lower() == 'success' else Colors.red}{status}{Colors.end}")
+        if status.lower() != 'success':
+            raise Exception(f'Error processing command {command_id} on instance {self.instance_id}: {status}')
+
+    # --------------------------------------------------------------------------- #
+    # the final status of the command, or None while it is still running
+    def _ssm_status_nowait(self, command_id):
+        ssm_client = get_client('ssm', self.region_name)
+        try:
+            cmd_invocation_resp = ssm_client.get_command_invocation(
+                CommandId=command_id,
+                InstanceId=self.instance_id,
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'InvocationDoesNotExist':
+                return None  # not registered yet
+            raise
+        status = cmd_invocation_resp.get('StatusDetails', '')
+        if status.lower() == 'success' or status.lower() in LinuxInstance.SSM_FAILED_STATUSES:
+            return status
+        return None
+
+    def _ssm_status(self, command_id, print_output=True, output_s3=None, s3_waits=None):
+        ssm_client = get_client('ssm', self.region_name)
 
         try:
             cmd_invocation_resp = ssm_client.get_command_invocation(
@@ -878,39 +1750,91 @@ class LinuxInstance(Instance):
             print(f"{Colors.red}Status not available for command {command_id}{Colors.end}")
             raise CommandInProgressException(f"Status not available for command {command_id}")
 
-        output = ''
         status = cmd_invocation_resp['StatusDetails']
         if status.lower() == 'success':
-            print(f"Command {command_id}: {Colors.grn}{status}{Colors.end}")
             # print(cmd_invocation_resp)
-            if 'StandardOutputContent' in cmd_invocation_resp:
-                output += cmd_invocation_resp['StandardOutputContent']
-            if 'StandardErrorContent' in cmd_invocation_resp and \
-                    len(cmd_invocation_resp['StandardErrorContent'].strip()) > 0:
-                output += Colors.red + cmd_invocation_resp['StandardErrorContent'] + Colors.end
-            # if len(output.strip()) <= 0:
-            #     output = status
-            if len(output.strip()) > 0:
-                lines = output.splitlines()
-                if print_output:
-                    for ln in lines:
-                        print(f'{Colors.grn}{ln.strip()}{Colors.end}')  # in green
+            if output_s3:
+                lines = self._s3_output_lines(command_id, output_s3[0], output_s3[1], print_output)
+                if lines is None and LinuxInstance._output_lines(cmd_invocation_resp, False):
+                    # the output objects can land in S3 a moment after the status changes
+                    if s3_waits is None:
+                        s3_waits = {'attempts': 0}
+                    s3_waits['attempts'] += 1
+                    if s3_waits['attempts'] < LinuxInstance.SSM_S3_OUTPUT_ATTEMPTS:
+                        raise CommandInProgressException(f"Waiting for output of {command_id} to reach S3")
+                    print(f"Command {command_id}: {Colors.grn}{status}{Colors.end}")
+                    print(f"{Colors.ylw}WARN: output of {command_id} never reached "
+                          f"s3://{output_s3[0]}/{output_s3[1]}, showing the inline (truncated) output{Colors.end}")
+                    return LinuxInstance._output_lines(cmd_invocation_resp, print_output)
+                print(f"Command {command_id}: {Colors.grn}{status}{Colors.end}")
                 return lines
-            else:
-                return None
-        elif status.lower() in [
-            'delivery timed out', 'execution timed out', 'failed', 'canceled', 'undeliverable', 'terminated',
-            'invalid platform', 'access denied'
-        ]:
+            print(f"Command {command_id}: {Colors.grn}{status}{Colors.end}")
+            return LinuxInstance._output_lines(cmd_invocation_resp, print_output)
+        elif status.lower() in LinuxInstance.SSM_FAILED_STATUSES:
             print(f"Command {command_id}: {Colors.red}{status}{Colors.end}")
             raise Exception(f'Error processing command {command_id} on instance {self.instance_id}: {status}')
         else:
             print(f"Command {command_id}: {Colors.red}{status}{Colors.end}")
             raise CommandInProgressException(f"{status}")
 
+    # --------------------------------------------------------------------------- #
+    # Lazily reads the stdout then (red) stderr objects SSM wrote under
+    # bucket/prefix/command_id/instance_id/, one line at a time.  Returns None if
+    # the command wrote no output.  Point AWS_ENDPOINT_URL_S3 at a local S3
+    # stand-in to exercise this without AWS.
+    def _s3_output_lines(self, command_id, bucket, prefix, print_output=True):
+        s3_client = get_client('s3', self.region_name)
+        key_prefix = f"{command_id}/{self.instance_id}/"
+        if prefix:
+            key_prefix = f"{prefix}/{key_prefix}"
+
+        keys = []
+        paginator = s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket, Prefix=key_prefix):
+            keys += [obj['Key'] for obj in page.get('Contents', [])]
+        stdout_keys = sorted(k for k in keys if k.endswith("/stdout"))
+        stderr_keys = sorted(k for k in keys if k.endswith("/stderr"))
+        if not stdout_keys and not stderr_keys:
+            return None
+
+        def lines():
+            for key, color in [(k, None) for k in stdout_keys] + [(k, Colors.red) for k in stderr_keys]:
+                with smart_open.open(f"s3://{bucket}/{key}", "r", encoding="utf-8", errors="replace",
+                                     transport_params={'client': s3_client}) as f:
+                    for ln in f:
+                        ln = ln.rstrip("\r\n")
+                        if color:
+                            ln = f"{color}{ln}{Colors.end}"
+                        if print_output:
+                            print(f'{Colors.grn}{ln.strip()}{Colors.end}')  # in green
+                        yield ln
+
+        return lines()
+
+    # --------------------------------------------------------------------------- #
+    # the stdout and (red) stderr lines of a finished command invocation, or None
+    @staticmethod
+    def _output_lines(cmd_invocation_resp, print_output=True):
+        output = ''
+        if 'StandardOutputContent' in cmd_invocation_resp:
+            output += cmd_invocation_resp['StandardOutputContent']
+        if 'StandardErrorContent' in cmd_invocation_resp and \
+                len(cmd_invocation_resp['StandardErrorContent'].strip()) > 0:
+            output += Colors.red + cmd_invocation_resp['StandardErrorContent'] + Colors.end
+        # if len(output.strip()) <= 0:
+        #     output = status
+        if len(output.strip()) > 0:
+            lines = output.splitlines()
+            if print_output:
+                for ln in lines:
+                    print(f'{Colors.grn}{ln.strip()}{Colors.end}')  # in green
+            return lines
+        else:
+            return None
+
     def probe(self):
         print(f"SSM status for {self.instance_id} is... ", end='')
-        ssm_client = boto3.client('ssm', region_name=self.region_name)
+        ssm_client = get_client('ssm', self.region_name)
         ssm_resp = ssm_client.get_connection_status(Target=self.instance_id)['Status']
         if ssm_resp == "connected":
             print(f"{Colors.grn}{ssm_resp}{Colors.end}")
@@ -921,9 +1845,17 @@ class LinuxInstance(Instance):
 
     # --------------------------------------------------------------------------- #
     # waits for ssh to activate and then looks for the "bootstrap complete" file
-    # in the home folder
-    @retry(stop=stop_after_attempt(60), wait=wait_fixed(15))
-    def is_ready(self):
+    # in the home folder, returns False if it never shows up
+    def is_ready(self, backoff=None):
+        if backoff is None:
+            backoff = LinuxInstance.READY_BACKOFF
+        try:
+            return poll(self._check_ready, backoff, phase="is_ready", retry_on=(Exception,))
+        except WaitTimeout as e:
+            print(f"{Colors.red}{e}{Colors.end}")
+            return False
+
+    def _check_ready(self):
 
         # ensure the system is online
         if not self.probe():
@@ -1,7 +1,9 @@
+import os
 import getopt
 import signal
 import sys
 from collections import UserDict
+from gwerks import metrics
 from gwerks.decorators import emitter
 from gwerks.packaging import VCS_GITHUB, Package
 
@@ -91,10 +93,23 @@ def _handle_sigterm(*args):
 
 
 # --------------------------------------------------------------------------- #
-# gwerks CLI entry point
+# gwerks CLI entry point.  With GWERKS_METRICS=1 a JSON summary of the
+# emitter metrics is printed on exit, and written in Prometheus text format to
+# GWERKS_METRICS_TEXTFILE if that is set.
 # --------------------------------------------------------------------------- #
-@emitter()
 def gwerks():
+    try:
+        _gwerks()
+    finally:
+        if metrics.is_enabled():
+            print(metrics.export_json(indent=2))
+            textfile = os.environ.get("GWERKS_METRICS_TEXTFILE")
+            if textfile:
+                metrics.export_prometheus(textfile)
+
+
+@emitter(override_func_name="gwerks")
+def _gwerks():
 
     _debug_traceback_limit = 1000
     sys.tracebacklimit = 0
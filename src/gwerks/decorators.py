@@ -1,10 +1,17 @@
 import os
+import asyncio
 import warnings
 import functools
+import inspect
 import sys
+import threading
 import traceback
+from contextvars import ContextVar
+from time import time, perf_counter
 
+from gwerks import metrics
 from gwerks.util import Colors
+from gwerks.sinks import Sink, ConsoleSink, EmitRecord, parse_level
 
 
 def deprecated(func):
@@ -22,76 +29,238 @@ def deprecated(func):
     return new_func
 
 
+# (frame, start time) of the innermost emitter-wrapped call in this thread or task
+_current_frame = ContextVar("gwerks_emitter_frame", default=None)
+
+# GWERKS_EMITTER=off turns emitters into plain function calls
+_enabled = os.environ.get("GWERKS_EMITTER", "on").strip().lower() not in ("0", "off", "false", "no")
+
+
+# --------------------------------------------------------------------------- #
+# Turns emitter formatting on or off for the whole process.  When off, every
+# emitter-wrapped call is a direct call and output passes through untouched.
+def set_emitter_enabled(enabled):
+    global _enabled
+    _enabled = bool(enabled)
+
+
+def is_emitter_enabled():
+    return _enabled
+
+
+# --------------------------------------------------------------------------- #
+# Where emitter output goes, see gwerks.sinks.  Defaults to a ConsoleSink
+# writing synchronously like always; wrap sinks in a QueuedSink to move their
+# I/O onto a background thread.
+_sinks = [ConsoleSink()]
+_console_only = True
+
+
+def set_emitter_sinks(sinks: list[Sink]):
+    global _sinks, _console_only
+    _sinks = list(sinks)
+    _console_only = len(_sinks) == 1 and type(_sinks[0]) is ConsoleSink and _sinks[0]._stream is None
+
+
+def add_emitter_sink(sink: Sink):
+    set_emitter_sinks(_sinks + [sink])
+
+
+def get_emitter_sinks():
+    return list(_sinks)
+
+
 def emitter(override_module_name=None, override_func_name=None):
     def emitter_decorator(func):
+        if override_func_name:
+            func_name = override_func_name
+        else:
+            func_name = func.__qualname__
+
+        if override_module_name:
+            mod_name = override_module_name
+        else:
+            mod_name = func.__module__
+
+        root = _EmitterFrame(mod_name, func_name)
+
         @functools.wraps(func)
         def emitter_wrapper(*args, **kwargs):
-            if override_func_name:
-                func_name = override_func_name
-            else:
-                func_name = func.__qualname__
-
-            if override_module_name:
-                mod_name = override_module_name
-            else:
-                mod_name = func.__module__
-
-            with EmitterContext(mod_name, func_name):
-                result = func(*args, **kwargs)
-                return result
+            emitting = _enabled
+            measuring = metrics.is_enabled()
+            if not emitting and not measuring:
+                return func(*args, **kwargs)
+
+            start = perf_counter()
+            error = False
+            token = None
+            if emitting:
+                _install_streams()
+                token = _current_frame.set((root.nested_in(_current_frame.get()), start))
+            try:
+                return func(*args, **kwargs)
+            except BaseException:
+                error = True
+                if emitting:
+                    sys.stdout.write(traceback.format_exc())
+                raise
+            finally:
+                if token is not None:
+                    _current_frame.reset(token)
+                if measuring:
+                    metrics.record_call(root.mod_name, root.func_name, perf_counter() - start, error)
                 # try:
                 #     result = func(*args, **kwargs)
                 #     return result
                 # except Exception as e:
                 #     raise Exception(f"ERROR in emitter: {e}").with_traceback(None) from None
 
+        # coroutine functions get an async wrapper so the frame is set for as
+        # long as the coroutine runs, in the context of the task awaiting it
+        @functools.wraps(func)
+        async def emitter_async_wrapper(*args, **kwargs):
+            emitting = _enabled
+            measuring = metrics.is_enabled()
+            if not emitting and not measuring:
+                return await func(*args, **kwargs)
+
+            start = perf_counter()
+            error = False
+            token = None
+            if emitting:
+                _install_streams()
+                token = _current_frame.set((root.nested_in(_current_frame.get()), start))
+            try:
+                return await func(*args, **kwargs)
+            except asyncio.CancelledError:
+                raise
+            except BaseException:
+                error = True
+                if emitting:
+                    sys.stdout.write(traceback.format_exc())
+                raise
+            finally:
+                if token is not None:
+                    _current_frame.reset(token)
+                if measuring:
+                    metrics.record_call(root.mod_name, root.func_name, perf_counter() - start, error)
+
+        if inspect.iscoroutinefunction(func):
+            return emitter_async_wrapper
         return emitter_wrapper
     return emitter_decorator
 
 
+# --------------------------------------------------------------------------- #
+# Prefixes output written while the block runs, like an emitter-wrapped call
 class EmitterContext:
     def __init__(self, mod_name: str, func_name: str):
-        self._stdout = sys.stdout
-        self._stderr = sys.stderr
+        self._frame = _EmitterFrame(mod_name, func_name)
+        self._token = None
+
+    def __enter__(self):
+        _install_streams()
+        self._token = _current_frame.set((self._frame.nested_in(_current_frame.get()), perf_counter()))
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is not None:
+            sys.stdout.write(traceback.format_exc())
+        _current_frame.reset(self._token)
 
+
+# --------------------------------------------------------------------------- #
+# One emitter-wrapped function at one position in the call stack.  Nested
+# emitters prefix their output with every enclosing emitter's name, so the
+# full prefixes are built once per call path and cached on the parent frame.
+class _EmitterFrame:
+    def __init__(self, mod_name: str, func_name: str, outer_prefix=""):
         self._func_name = func_name
 
         self._mod_name = mod_name.strip()
         if self._mod_name.endswith(":"):
             self._mod_name = self._mod_name[:-1]
 
-    def __enter__(self):
-        sys.stdout = self
-        sys.stderr = self
-
-    def write(self, msg):
-        try:
-            msg = msg.strip()
-            if len(msg) > 0:
-                msg = self._format(msg)
-                self._stdout.write(f"{msg}{os.linesep}")
-        except Exception as e:
-            msg = self._format(f"ERROR: {e}")
-            self._stderr.write(f"{msg}{os.linesep}")
-
-    def _format(self, msg):
         # prefix = f"{self._mod_name}.{self._func_name}: "
         prefix = f"{self._func_name}: "
+        self._outer = outer_prefix
+        self._plain = f"{outer_prefix}{Colors.grn}{prefix}{Colors.end}"
+        self._warn = f"{outer_prefix}{Colors.ylw}{prefix}"
+        self._error = f"{outer_prefix}{Colors.red}{prefix}"
+        self._success = f"{outer_prefix}{Colors.grn}{prefix}"
+        self._children = {}
+
+    # --------------------------------------------------------------------------- #
+    # the frame for this function when called inside `parent` (None at top level)
+    def nested_in(self, current):
+        if current is None:
+            return self
+        parent = current[0]
+        child = parent._children.get(self)
+        if child is None:
+            child = parent._children.setdefault(self, _EmitterFrame(self._mod_name, self._func_name,
+                                                                    parent._plain))
+        return child
+
+    @property
+    def mod_name(self):
+        return self._mod_name
+
+    @property
+    def func_name(self):
+        return self._func_name
+
+    def format(self, msg):
         if msg.startswith("WARN: "):
-            msg = f"{Colors.ylw}{prefix}{msg[6:]}{Colors.end}"
+            return f"{self._warn}{msg[6:]}{Colors.end}"
         elif msg.startswith("ERROR: "):
-            msg = f"{Colors.red}{prefix}{msg[7:]}{Colors.end}"
+            return f"{self._error}{msg[7:]}{Colors.end}"
         elif msg.startswith("SUCCESS: "):
-            msg = f"{Colors.grn}{prefix}{msg[9:]}{Colors.end}"
+            return f"{self._success}{msg[9:]}{Colors.end}"
         else:
-            msg = f"{Colors.grn}{prefix}{Colors.end}{msg}"
-        return f"{msg}"
+            return f"{self._plain}{msg}"
 
-    def __exit__(self, exc_type, exc_value, tb):
-        if exc_type is not None:
-            self.write(traceback.format_exc())
-        sys.stdout = self._stdout
-        sys.stderr = self._stderr
+
+# --------------------------------------------------------------------------- #
+# Installed once as sys.stdout and sys.stderr.  Writes made inside an emitter
+# are stripped, prefixed and sent to the real stdout; everything else goes to
+# the wrapped stream unchanged.  The current emitter is looked up per thread
+# or task, so concurrent emitters never see each other's output.  A thread
+# started inside an emitter only keeps its prefix when it runs under
+# contextvars.copy_context().run, as run_dag and Fleet.launch do.
+class _EmitterStream:
+    def __init__(self, stream, stdout):
+        self._stream = stream
+        self._stdout = stdout
+
+    def write(self, msg):
+        current = _current_frame.get()
+        if current is None:
+            return self._stream.write(msg)
+        frame = current[0]
+        try:
+            msg = msg.strip()
+            if len(msg) > 0:
+                if _console_only:
+                    self._stdout.write(f"{frame.format(msg)}{os.linesep}")
+                    return
+                level, message = parse_level(msg)
+                record = EmitRecord(time(), frame.mod_name, frame.func_name, level, message, msg,
+                                    threading.current_thread().name, perf_counter() - current[1], frame,
+                                    self._stdout)
+                for sink in _sinks:
+                    sink.emit(record)
+        except Exception as e:
+            self._stream.write(f"{frame.format(f'ERROR: {e}')}{os.linesep}")
 
     def flush(self):
-        self._stdout.flush()
+        self._stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+def _install_streams():
+    if type(sys.stdout) is not _EmitterStream:
+        sys.stdout = _EmitterStream(sys.stdout, sys.stdout)
+    if type(sys.stderr) is not _EmitterStream:
+        sys.stderr = _EmitterStream(sys.stderr, sys.stdout._stdout)
@@ -1,15 +1,207 @@
+import io
 import os
-import socket
+import re
+import stat
 import shutil
-import tempfile
+import hashlib
+import shlex
+import socket
+import asyncio
+import urllib.request
+import tarfile
+import contextlib
+import threading
+from time import time, monotonic
 from typing import Optional
 
-from smart_open import open
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
 
 from . import aws
-from . import environment, is_dev_environment, region, profile, uid
-from .util.sys import sudo, exec_cmd
+from . import environment, is_dev_environment, region, profile
+from .util.sys import sudo, exec_cmd, aexec_cmd, exec_cmd_stream, CommandStream, shell_session
+from .util import Colors
+from .util.digests import digest_index, cache_dir
+from .util.compress import parse_compression, open_compressor, CountingWriter
+from .util.runner import run_dag, arun_dag, TaskResult
+from .util.wait import poll, Backoff, NotReady, WaitTimeout
 from .decorators import emitter
+from .docker_api import DockerApi
+from .dockerignore import DockerIgnore, read_dockerignore
+
+
+# --------------------------------------------------------------------------- #
+# Opt-in: run the short DockerService and DockerNetwork commands (docker ps,
+# network inspect/create/rm, ...) through the shared ShellSession instead of
+# starting a shell for each one.  Turn on with use_shell_session() or
+# GWERKS_DOCKER_SHELL_SESSION=1.
+_use_shell_session = os.environ.get("GWERKS_DOCKER_SHELL_SESSION", "").strip().lower() in ("1", "on", "true", "yes")
+
+
+def use_shell_session(enabled=True):
+    global _use_shell_session
+    _use_shell_session = bool(enabled)
+
+
+def _docker_cmd(cmd, raise_exc=True, no_sudo=True, return_tuple=False):
+    if _use_shell_session:
+        return shell_session().run(cmd, raise_exc=raise_exc, no_sudo=no_sudo, return_tuple=return_tuple)
+    return exec_cmd(cmd, raise_exc=raise_exc, no_sudo=no_sudo, return_tuple=return_tuple)
+
+
+# --------------------------------------------------------------------------- #
+# Opt-in: use the Docker Engine API on its unix socket (see DockerApi) for
+# ping, prune, networks, docker_build and docker_stop instead of the docker
+# CLI.  Turn on with use_docker_backend(BACKEND_API) or
+# GWERKS_DOCKER_BACKEND=api; the socket is DOCKER_HOST when that is a unix://
+# url.  The CLI is still used when the socket is missing or not accessible
+# to us (e.g. it needs sudo), for the docker service itself and docker_run.
+BACKEND_CLI = "cli"
+BACKEND_API = "api"
+BACKENDS = [BACKEND_CLI, BACKEND_API]
+
+_docker_backend = os.environ.get("GWERKS_DOCKER_BACKEND", BACKEND_CLI).strip().lower()
+_docker_api = None
+
+
+def use_docker_backend(backend=BACKEND_API, socket_path=None):
+    global _docker_backend, _docker_api
+    if backend not in BACKENDS:
+        raise Exception(f"backend must be one of {BACKENDS}, not '{backend}'")
+    _docker_backend = backend
+    _docker_api = DockerApi(socket_path or _default_socket_path())
+
+
+def _default_socket_path():
+    docker_host = os.environ.get("DOCKER_HOST", "")
+    if docker_host.startswith("unix://"):
+        return docker_host[len("unix://"):]
+    return DockerApi.DEFAULT_SOCKET
+
+
+# the DockerApi to use, or None to use the CLI
+def _api():
+    global _docker_api
+    if _docker_backend != BACKEND_API:
+        return None
+    if _docker_api is None:
+        _docker_api = DockerApi(_default_socket_path())
+    return _docker_api if _docker_api.available() else None
+
+
+# --------------------------------------------------------------------------- #
+# What gwerks knows about the daemon: whether it is running, and which
+# networks and containers exist (by name).  Each entry is trusted for `ttl`
+# seconds (0 turns the cache off).  watch_events() follows the daemon's event
+# stream on a background thread (API backend only), and while it runs the
+# entries it maintains never expire.  gwerks' own changes (service start/stop,
+# prune, network create/rm, docker run/stop) update the entries directly.
+class DockerState:
+
+    def __init__(self, ttl=5.0):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._running = None
+        self._networks = {}
+        self._containers = {}
+        self._watch_since = None
+
+    # --------------------------------------------------------------------------- #
+    # daemon liveness, calling probe() when the cached value is stale
+    def is_running(self, probe):
+        known = self.running()
+        if known is not None:
+            return known
+        running = probe()
+        self.set_running(running)
+        return running
+
+    # True/False when known, None when unknown or stale
+    def running(self):
+        with self._lock:
+            return self._fresh(self._running)
+
+    def set_running(self, running):
+        with self._lock:
+            self._running = (running, monotonic())
+            if not running:
+                self._networks.clear()
+                self._containers.clear()
+
+    # True/False when known, None when unknown or stale
+    def network_exists(self, name):
+        with self._lock:
+            return self._fresh(self._networks.get(name))
+
+    def set_network(self, name, exists):
+        with self._lock:
+            self._networks[name] = (exists, monotonic())
+
+    def container_exists(self, name):
+        with self._lock:
+            return self._fresh(self._containers.get(name))
+
+    def set_container(self, name, exists):
+        with self._lock:
+            self._containers[name] = (exists, monotonic())
+
+    # --------------------------------------------------------------------------- #
+    # forget everything, or only the networks and containers
+    def invalidate(self, resources_only=False):
+        with self._lock:
+            if not resources_only:
+                self._running = None
+            self._networks.clear()
+            self._containers.clear()
+
+    # --------------------------------------------------------------------------- #
+    # Starts following the daemon's events, returns False if the API backend
+    # isn't available or the daemon isn't running.  When the stream ends (e.g.
+    # the daemon stops) the cache is invalidated and falls back to the TTL.
+    def watch_events(self):
+        api = _api()
+        if api is None or not api.ping():
+            return False
+        with self._lock:
+            if self._watch_since is not None:
+                return True
+            self._watch_since = monotonic()
+        self.set_running(True)
+        threading.Thread(target=self._watch, args=(api,), name="gwerks-docker-events", daemon=True).start()
+        return True
+
+    def _watch(self, api):
+        try:
+            for event in api.events({"type": ["network", "container"]}):
+                name = event.get("Actor", {}).get("Attributes", {}).get("name")
+                action = event.get("Action") or event.get("status")
+                if not name or action not in ("create", "destroy"):
+                    continue
+                if event.get("Type") == "network":
+                    self.set_network(name, action == "create")
+                elif event.get("Type") == "container":
+                    self.set_container(name, action == "create")
+        except Exception:
+            pass  # the daemon went away, fall back to probing
+        finally:
+            with self._lock:
+                self._watch_since = None
+            self.invalidate()
+
+    def _fresh(self, entry):
+        if entry is None:
+            return None
+        value, recorded = entry
+        if self._watch_since is not None and recorded >= self._watch_since:
+            return value
+        if monotonic() - recorded < self.ttl:
+            return value
+        return None
+
+
+docker_state = DockerState(float(os.environ.get("GWERKS_DOCKER_STATE_TTL", "5")))
 
 
 class DockerService:
@@ -19,20 +211,31 @@ class DockerService:
     @staticmethod
     def start():
         if not DockerService.is_running():
-            exec_cmd(f"service docker start || true", no_sudo=is_dev_environment())
+            _docker_cmd(f"service docker start || true", no_sudo=is_dev_environment())
+            docker_state.invalidate()
 
     # --------------------------------------------------------------------------- #
-    # raise exc if service is not running
+    # raise exc if service is not running, recently seen running is good enough
     @staticmethod
     def assert_is_running():
-        if not DockerService.is_running():
+        if not docker_state.is_running(DockerService._probe):
             raise Exception(f"Docker service is not running")
 
     # --------------------------------------------------------------------------- #
     # use docker info to see if Docker is running
     @staticmethod
     def is_running():
-        result, exit_code = exec_cmd(f"docker ps", raise_exc=False, no_sudo=is_dev_environment(), return_tuple=True)
+        running = DockerService._probe()
+        docker_state.set_running(running)
+        return running
+
+    @staticmethod
+    def _probe():
+        api = _api()
+        if api is not None:
+            return api.ping()
+        result, exit_code = _docker_cmd(["docker", "ps"], raise_exc=False, no_sudo=is_dev_environment(),
+                                        return_tuple=True)
         # exit_code = result.returncode
         return exit_code == 0
 
@@ -45,14 +248,59 @@ class DockerService:
     @staticmethod
     def prune():
         DockerService.assert_is_running()
-        exec_cmd(f"docker system prune -f", no_sudo=is_dev_environment())
+        api = _api()
+        try:
+            if api is not None:
+                api.prune()
+            else:
+                _docker_cmd(["docker", "system", "prune", "-f"], no_sudo=is_dev_environment())
+        finally:
+            docker_state.invalidate(resources_only=True)
 
     # --------------------------------------------------------------------------- #
     # service docker start
     @staticmethod
     def stop():
         if DockerService.is_running():
-            exec_cmd(f"service docker stop || true", no_sudo=is_dev_environment())
+            _docker_cmd(f"service docker stop || true", no_sudo=is_dev_environment())
+            docker_state.invalidate()
+
+    # --------------------------------------------------------------------------- #
+    # asyncio versions of the above
+    @staticmethod
+    async def astart():
+        if not await DockerService.ais_running():
+            await aexec_cmd(f"service docker start || true", no_sudo=is_dev_environment())
+            docker_state.invalidate()
+
+    @staticmethod
+    async def aassert_is_running():
+        running = docker_state.running()
+        if running is None:
+            running = await DockerService.ais_running()
+        if not running:
+            raise Exception(f"Docker service is not running")
+
+    @staticmethod
+    async def ais_running():
+        result, exit_code = await aexec_cmd(["docker", "ps"], raise_exc=False, no_sudo=is_dev_environment(),
+                                            return_tuple=True)
+        docker_state.set_running(exit_code == 0)
+        return exit_code == 0
+
+    @staticmethod
+    async def aprune():
+        await DockerService.aassert_is_running()
+        try:
+            await aexec_cmd(["docker", "system", "prune", "-f"], no_sudo=is_dev_environment())
+        finally:
+            docker_state.invalidate(resources_only=True)
+
+    @staticmethod
+    async def astop():
+        if await DockerService.ais_running():
+            await aexec_cmd(f"service docker stop || true", no_sudo=is_dev_environment())
+            docker_state.invalidate()
 
 
 class DockerNetwork:
@@ -94,7 +342,49 @@ class DockerNetwork:
     # --------------------------------------------------------------------------- #
     # docker network create
     def create(self):
+        if docker_state.network_exists(self._name):
+            return
+        DockerService.assert_is_running()
+        api = _api()
+        if api is not None:
+            if api.network_inspect(self._name) is None:
+                api.network_create(self._name, self._driver)
+        else:
+            _docker_cmd(self._create_cmd(), no_sudo=is_dev_environment())
+        docker_state.set_network(self._name, True)
+
+    # --------------------------------------------------------------------------- #
+    # docker network rm
+    def destroy(self):
+        if docker_state.network_exists(self._name) is False:
+            return
         DockerService.assert_is_running()
+        api = _api()
+        if api is not None:
+            if self._name is None:
+                raise Exception(f"net_name was None when destroying network")
+            api.network_remove(self._name)
+        else:
+            _docker_cmd(self._destroy_cmd(), no_sudo=is_dev_environment())
+        docker_state.set_network(self._name, False)
+
+    # --------------------------------------------------------------------------- #
+    # asyncio versions of create and destroy
+    async def acreate(self):
+        if docker_state.network_exists(self._name):
+            return
+        await DockerService.aassert_is_running()
+        await aexec_cmd(self._create_cmd(), no_sudo=is_dev_environment())
+        docker_state.set_network(self._name, True)
+
+    async def adestroy(self):
+        if docker_state.network_exists(self._name) is False:
+            return
+        await DockerService.aassert_is_running()
+        await aexec_cmd(self._destroy_cmd(), no_sudo=is_dev_environment())
+        docker_state.set_network(self._name, False)
+
+    def _create_cmd(self):
         # cmd = f"{sudo(no_sudo=is_dev_environment())} docker network create --driver {self._driver} {self._name}"
         cmd = (f"{sudo(no_sudo=is_dev_environment())} docker network inspect {self._name} "
                f"|| "
@@ -104,15 +394,55 @@ class DockerNetwork:
         #           f"|| {sudo(no_sudo=is_dev_environment())} docker network create --driver {self._driver} {self._name}"
         # else:
         #     cmd = f"docker network create --driver {self._driver} "
-        exec_cmd(cmd, no_sudo=is_dev_environment())
+        return cmd
 
-    # --------------------------------------------------------------------------- #
-    # docker network rm
-    def destroy(self):
-        DockerService.assert_is_running()
+    def _destroy_cmd(self):
         if self._name is None:
             raise Exception(f"net_name was None when destroying network")
-        exec_cmd(f"docker network rm {self._name} || true", no_sudo=is_dev_environment())
+        return f"docker network rm {self._name} || true"
+
+
+# --------------------------------------------------------------------------- #
+# wall-clock time of the phases of a docker_build, printed at the end so the
+# compression can be tuned per host.  The context phase of a streamed build
+# overlaps the build phase, since the daemon reads the context as it goes.
+class _BuildTiming:
+
+    class _Phase:
+        def __init__(self, timing, name):
+            self._timing = timing
+            self._name = name
+            self._start = monotonic()
+
+        def end(self):
+            self._timing.elapsed[self._name] = monotonic() - self._start
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, exc_type, exc_value, tb):
+            self.end()
+
+    def __init__(self):
+        self.elapsed = {}
+
+    def phase(self, name):
+        return _BuildTiming._Phase(self, name)
+
+    def summary(self, stats):
+        parts = []
+        for name in ("manifest", "hash", "context", "build"):
+            if name not in self.elapsed:
+                continue
+            part = f"{name} {self.elapsed[name]:.2f}s"
+            if name == "context" and "raw" in stats:
+                part += f" ({_mb(stats['raw'])} -> {_mb(stats['compressed'])}, {stats['compression']})"
+            parts.append(part)
+        return f"timing: {', '.join(parts)}"
+
+
+def _mb(size):
+    return f"{size / (1024 * 1024):.1f} MB"
 
 
 class DockerBase:
@@ -165,13 +495,39 @@ class DockerBase:
         if "docker_use_buildkit" in config:
             self._use_buildkit = config["docker_use_buildkit"]
 
+        # skip docker_build when the image already has the context's hash
+        self._build_skip_unchanged = True
+        if "docker_build_skip_unchanged" in config:
+            self._build_skip_unchanged = config["docker_build_skip_unchanged"]
+
+        # opt-in: keep the build context in a directory that is synced before
+        # each build and handed to `docker build <dir>`, True for one under
+        # the gwerks cache dir named after the app and the image
+        self._build_context_dir = None
+        if config.get("docker_build_context_dir"):
+            self._build_context_dir = config["docker_build_context_dir"]
+
+        # how the streamed build context is compressed: none, gzip[:level],
+        # pgzip[:level] (parallel gzip) or zstd[:level], defaults to
+        # GWERKS_DOCKER_BUILD_COMPRESSION or gzip:6
+        self._build_compression = parse_compression(
+            config.get("docker_build_compression", os.environ.get("GWERKS_DOCKER_BUILD_COMPRESSION", "gzip:6")))
+
         self._docker_app_files = []
         if 'docker_app_files' in config:
             self._docker_app_files = config['docker_app_files']
 
+        # .dockerignore patterns for the directories in docker_app_files,
+        # applied after DOCKER_IGNORE_PATTERNS and their own .dockerignore
+        self._docker_ignore = []
+        if 'docker_ignore' in config:
+            self._docker_ignore = config['docker_ignore']
+
+        self._dockerfile_str = None
         if 'dockerfile_str' in config:
             self._dockerfile_str = config['dockerfile_str']
 
+        self._dockerfile_file = None
         if 'dockerfile_file' in config:
             self._dockerfile_file = config['dockerfile_file']
 
@@ -179,9 +535,33 @@ class DockerBase:
         if "docker_app_cloud_creds_pass_through" in config:
             self._docker_app_cloud_creds_pass_through = config["docker_app_cloud_creds_pass_through"]
 
-        the_build_context = uid("docker_build_context")
-        self._tar_file_name = f"{the_build_context}.tar.gz"
-        self._build_context_fp = f"{tempfile.gettempdir()}/{the_build_context}"
+        # DockerSystem settings
+
+        # names of the apps in the system that must be started (and ready)
+        # before this one
+        self._depends_on = []
+        if "depends_on" in config:
+            self._depends_on = list(config["depends_on"])
+
+        # readiness probes, all must pass before the app counts as started:
+        # ready_tcp (True) get_port() accepts connections, ready_url answers
+        # with a status below 400, ready_log is a grep -E pattern matching a
+        # line of the container's logs
+        self._ready_tcp = False
+        if "ready_tcp" in config:
+            self._ready_tcp = config["ready_tcp"]
+
+        self._ready_url = None
+        if "ready_url" in config:
+            self._ready_url = config["ready_url"]
+
+        self._ready_log = None
+        if "ready_log" in config:
+            self._ready_log = config["ready_log"]
+
+        self._ready_timeout = 300
+        if "ready_timeout" in config:
+            self._ready_timeout = config["ready_timeout"]
 
     def start(self):
         raise Exception("start() is not implemented")
@@ -189,6 +569,16 @@ class DockerBase:
     def stop(self):
         raise Exception("stop() is not implemented")
 
+    # --------------------------------------------------------------------------- #
+    # asyncio versions of start and stop, by default the blocking ones on a
+    # worker thread.  Override with native versions built on adocker_build,
+    # adocker_run and adocker_stop.
+    async def astart(self):
+        return await asyncio.to_thread(self.start)
+
+    async def astop(self):
+        return await asyncio.to_thread(self.stop)
+
     def get_sys_name(self):
         if not self._sys_name:
             raise Exception("sys_name is not set")
@@ -212,62 +602,286 @@ class DockerBase:
     def get_docker_container_name(self):
         return f"{self.get_sys_name()}-{self.get_name()}_{self.get_port()}"
 
+    def get_depends_on(self):
+        return self._depends_on
+
     def set_docker_network(self, network):
         self._network = network
 
     def get_docker_network(self):
         return self._network
 
+    # --------------------------------------------------------------------------- #
+    # builds the app's image, DockerSystem.build does this for all apps at once
+    def build(self, no_cache=False):
+        self.docker_build(self._image_name, no_cache)
+
+    # --------------------------------------------------------------------------- #
+    # Polls the readiness probes until they all pass, raises if they don't
+    # within ready_timeout seconds.  Returns at once without probes.
+    @emitter()
+    def wait_ready(self):
+        probes = []
+        if self._ready_tcp:
+            probes.append(self._probe_tcp)
+        if self._ready_url:
+            probes.append(self._probe_url)
+        if self._ready_log:
+            probes.append(self._probe_log)
+        if not probes:
+            return
+
+        def ready():
+            for probe in probes:
+                probe()
+            return True
+
+        backoff = Backoff(first=0, initial=0.5, factor=1.5, maximum=5, timeout=self._ready_timeout)
+        try:
+            poll(ready, backoff, phase="wait_ready", retry_on=(OSError,))
+        except WaitTimeout as e:
+            raise Exception(f"ERROR: {self.get_docker_container_name()} is not ready: {e}")
+        print(f"{self.get_docker_container_name()} is {Colors.grn}ready{Colors.end}")
+
+    def _probe_tcp(self):
+        socket.create_connection(("localhost", self.get_port()), timeout=2).close()
+
+    def _probe_url(self):
+        with urllib.request.urlopen(self._ready_url, timeout=5) as response:
+            response.read()
+
+    def _probe_log(self):
+        cmd = (f"docker logs {self.get_docker_container_name()} 2>&1 "
+               f"| grep -E -q -e {shlex.quote(self._ready_log)}")
+        if exec_cmd(cmd, raise_exc=False, no_sudo=is_dev_environment(), return_tuple=True)[1] != 0:
+            raise NotReady(self._ready_log)
+
+    # --------------------------------------------------------------------------- #
+    # Builds the image from docker_app_files and the Dockerfile.  The build
+    # context is tarred on the fly straight from the sources into the build
+    # (docker build's stdin, or the Engine API when docker_use_buildkit is
+    # off), nothing is staged on disk.
+    # With docker_build_context_dir (CLI builds) the context directory is
+    # synced instead and built from, so BuildKit only transfers changed files.
+    # The image is labelled with a hash of the context, and unless no_cache
+    # is set the build is skipped when image_name already carries that hash.
+    # The context is compressed as docker_build_compression says, and the
+    # time each phase took is printed at the end.
     @emitter()
     def docker_build(self, image_name, no_cache=False):
+        self._docker_build(image_name, no_cache)
+
+    # the image label holding the build context hash
+    CONTEXT_HASH_LABEL = "gwerks.context-hash"
+
+    def _docker_build(self, image_name, no_cache):
+        timing = _BuildTiming()
+        with timing.phase("manifest"):
+            manifest = self._docker_build_manifest()
+        with timing.phase("hash"):
+            context_hash = self._docker_build_hash(manifest)
 
-        if not os.path.exists(self._build_context_fp):
-            print(f"makedirs: {self._build_context_fp}")
-            os.makedirs(self._build_context_fp)
+        DockerService.assert_is_running()
+
+        if self._build_skip_unchanged and not no_cache:
+            if DockerBase._image_context_hash(image_name) == context_hash:
+                print(f"SUCCESS: {image_name} is up to date ({context_hash[:12]}), skipped the build")
+                return
+        labels = {DockerBase.CONTEXT_HASH_LABEL: context_hash}
+
+        errors = []
+        stats = {}
+
+        def send_context(pipe):
+            try:
+                with timing.phase("context"):
+                    DockerBase._write_context(manifest, pipe, self._build_compression, stats)
+            except BrokenPipeError:
+                pass  # the build stopped reading, it reports its own error
+            except Exception as e:
+                errors.append(e)
+
+        build_phase = timing.phase("build")
+        try:
+            # BuildKit over the Engine API needs a gRPC session, which DockerApi
+            # doesn't speak, so BuildKit builds always go through the CLI
+            api = _api() if not self._use_buildkit else None
+            if api is not None:
+                read_fd, write_fd = os.pipe()
+                writer = threading.Thread(target=lambda: send_context(io.open(write_fd, 'wb')),
+                                          name="gwerks-build-context", daemon=True)
+                writer.start()
+                try:
+                    with io.open(read_fd, 'rb') as context:
+                        self._print_build_messages(api.build(context, image_name, self._docker_build_args(),
+                                                             no_cache, labels))
+                finally:
+                    writer.join()
+            elif self._build_context_dir:
+                context_dir = self._get_build_context_dir()
+                with _context_dir_lock(context_dir):
+                    with timing.phase("context"):
+                        copied, deleted = DockerBase._sync_context(manifest, context_dir)
+                    print(f"synced {context_dir}: {copied} copied, {deleted} deleted")
+                    self._exec_stream(self._docker_build_cmd(image_name, no_cache, labels, context=context_dir))
+            else:
+                self._exec_stream(self._docker_build_cmd(image_name, no_cache, labels), send_to_stdin=send_context)
+        except Exception:
+            if errors:
+                raise errors[0]
+            raise
+        finally:
+            build_phase.end()
+            print(timing.summary(stats))
+        if errors:
+            raise errors[0]
 
+    def _get_build_context_dir(self):
+        if self._build_context_dir is True:
+            name = re.sub(r"[^A-Za-z0-9_.-]", "_", f"{self.get_name()}-{self._image_name}")
+            return os.path.join(cache_dir(), "build-contexts", name)
+        return self._build_context_dir
+
+    @staticmethod
+    def _print_build_messages(messages):
+        for message in messages:
+            if "stream" in message:
+                for line in message["stream"].splitlines():
+                    if line.strip():
+                        print(line)
+            elif "status" in message:
+                print(f"{message['status']} {message.get('progress', '')}")
+
+    # --------------------------------------------------------------------------- #
+    # asyncio version of docker_build, the build runs on a worker thread (and
+    # runs to completion even if the awaiting task is cancelled)
+    @emitter()
+    async def adocker_build(self, image_name, no_cache=False):
+        await asyncio.to_thread(self._docker_build, image_name, no_cache)
+
+    # --------------------------------------------------------------------------- #
+    # {arcname: source} for the build context, a source is a path or, for
+    # dockerfile_str, the file's bytes.  Later entries replace earlier ones.
+    def _docker_build_manifest(self):
+        manifest = {}
         for file in self._docker_app_files:
-            self._copy_from(file)
+            self._manifest_add(manifest, file)
 
         if self._dockerfile_str:
-            the_dockerfile = f"{self._build_context_fp}/Dockerfile"
-            print(f"write: {the_dockerfile}")
-            with open(the_dockerfile, 'w') as f:
-                f.write(self._dockerfile_str)
+            print("add dockerfile_str -> Dockerfile")
+            manifest["Dockerfile"] = self._dockerfile_str.encode()
         elif self._dockerfile_file:
-            if not self._copy_from(self._dockerfile_file):
+            if not self._manifest_add(manifest, self._dockerfile_file):
                 raise Exception(f"copying {self._dockerfile_file} failed")
         else:
             raise Exception(f"either 'dockerfile_str' or 'dockerfile_file' must be specified")
+        return manifest
 
+    def _docker_build_cmd(self, image_name, no_cache, labels=None, context="-"):
         cmd = ""
-        cmd += f"tar -C {self._build_context_fp} -czf {self._tar_file_name} ."
-        self._exec(cmd)
-
-        DockerService.assert_is_running()
+        if self._use_buildkit:
+            cmd += f"DOCKER_BUILDKIT=1 "
+        cmd += f"docker build "
+        if no_cache:
+            cmd += "--no-cache "
+        for name, value in self._docker_build_args().items():
+            cmd += f"--build-arg {name}={value} "
+        for name, value in (labels or {}).items():
+            cmd += f"--label {name}={value} "
+        cmd += f"-t {image_name} "
+        cmd += f"{context} "
+        return cmd
 
-        try:
-            cmd = ""
-            if self._use_buildkit:
-                cmd += f"DOCKER_BUILDKIT=1 "
-            cmd += f"docker build "
-            if no_cache:
-                cmd += "--no-cache "
-            if self._docker_app_cloud_creds_pass_through == "aws":
-                access_key, secret_key = aws.get_credentials()
-                cmd += f"--build-arg AWS_ACCESS_KEY_ID={access_key} "
-                cmd += f"--build-arg AWS_SECRET_ACCESS_KEY={secret_key} "
-            cmd += f"-t {image_name} "
-            cmd += f"- < {self._tar_file_name } "
-            self._exec(cmd)
+    # --------------------------------------------------------------------------- #
+    # sha256 over the context as built: every entry's name, type, mode and
+    # content digest (through the shared DigestIndex, so unchanged files are
+    # not re-read), plus the build args other than credentials
+    def _docker_build_hash(self, manifest):
+        h = hashlib.sha256()
+        index = digest_index()
+        for arcname, source in sorted(manifest.items()):
+            if isinstance(source, bytes):
+                entry = f"{arcname}\0file\0{0o644:o}\0{hashlib.sha256(source).hexdigest()}"
+            else:
+                st = os.stat(source)
+                if stat.S_ISDIR(st.st_mode):
+                    kind, digest = "dir", ""
+                elif stat.S_ISREG(st.st_mode):
+                    kind, digest = "file", index.digest(source)
+                else:
+                    kind, digest = "other", ""
+                entry = f"{arcname}\0{kind}\0{stat.S_IMODE(st.st_mode):o}\0{digest}"
+            h.update(entry.encode("utf-8", "surrogateescape") + b"\n")
+        index.save()
+
+        h.update(f"creds\0{self._docker_app_cloud_creds_pass_through}\n".encode())
+        for name, value in sorted(self._docker_build_args(credentials=False).items()):
+            h.update(f"arg\0{name}\0{value}\n".encode())
+        return h.hexdigest()
+
+    # the context hash label of the local image, None if there is no such image
+    @staticmethod
+    def _image_context_hash(image_name):
+        api = _api()
+        if api is not None:
+            image = api.image_inspect(image_name) or {}
+            return ((image.get("Config") or {}).get("Labels") or {}).get(DockerBase.CONTEXT_HASH_LABEL)
+        result, exit_code = _docker_cmd(
+            ["docker", "image", "inspect", "--format",
+             f'{{{{ index .Config.Labels "{DockerBase.CONTEXT_HASH_LABEL}" }}}}', image_name],
+            raise_exc=False, no_sudo=is_dev_environment(), return_tuple=True)
+        if exit_code != 0:
+            return None
+        return result.strip()
 
-        finally:
-            cmd = ""
-            cmd += f"rm {self._tar_file_name} && rm -rf {self._build_context_fp}"
-            self._exec(cmd)
+    # --------------------------------------------------------------------------- #
+    # --build-arg values, credentials=False leaves out the cloud credentials
+    def _docker_build_args(self, credentials=True):
+        build_args = {}
+        if credentials and self._docker_app_cloud_creds_pass_through == "aws":
+            access_key, secret_key, token = aws.get_credentials(include_token=True)
+            build_args["AWS_ACCESS_KEY_ID"] = access_key
+            build_args["AWS_SECRET_ACCESS_KEY"] = secret_key
+            if token:
+                build_args["AWS_SESSION_TOKEN"] = token
+        return build_args
 
     def docker_run(self, cmd_line=None, env_vars=None):
         self.docker_stop()
+        result = self._exec(self._docker_run_cmd(cmd_line, env_vars))
+        docker_state.set_container(self.get_docker_container_name(), True)
+        return result
 
+    def docker_stop(self):
+        container_name = self.get_docker_container_name()
+        if docker_state.container_exists(container_name) is False:
+            return
+        api = _api()
+        if api is not None:
+            api.container_remove(container_name, force=True)
+            result = None
+        else:
+            result = self._exec(self._docker_stop_cmd())
+        docker_state.set_container(container_name, False)
+        return result
+
+    # --------------------------------------------------------------------------- #
+    # asyncio versions of docker_run and docker_stop
+    async def adocker_run(self, cmd_line=None, env_vars=None):
+        await self.adocker_stop()
+        result = await self._aexec(self._docker_run_cmd(cmd_line, env_vars))
+        docker_state.set_container(self.get_docker_container_name(), True)
+        return result
+
+    async def adocker_stop(self):
+        container_name = self.get_docker_container_name()
+        if docker_state.container_exists(container_name) is False:
+            return
+        result = await self._aexec(self._docker_stop_cmd())
+        docker_state.set_container(container_name, False)
+        return result
+
+    def _docker_run_cmd(self, cmd_line, env_vars):
         cmd = ""
         cmd += f"docker run -d --name {self.get_docker_container_name()} "
         cmd += f"--env RUNTIME_ENV={environment()} "
@@ -294,15 +908,15 @@ class DockerBase:
         cmd += f"{self._image_name} "
         if cmd_line:
             cmd += f"{cmd_line} "
-        return self._exec(cmd)
+        return cmd
 
-    def docker_stop(self):
+    def _docker_stop_cmd(self):
         cmd = ""
         cmd += (f'docker ps -a -q --filter "name={self.get_docker_container_name()}" '
                 f'&& '
                 f'docker rm -f {self.get_docker_container_name()} ')
         # cmd += f"docker rm --force {self.get_docker_container_name()} "
-        return self._exec(cmd)
+        return cmd
 
     def _docker_run_log_driver(self):
         cmd = ""
@@ -326,24 +940,35 @@ class DockerBase:
             cmd += f"--env AWS_SECRET_ACCESS_KEY=$AWS_SECRET_ACCESS_KEY "
         return cmd
 
+    # --------------------------------------------------------------------------- #
+    # .dockerignore patterns left out of every directory added to the build
+    # context, whatever its depth
+    DOCKER_IGNORE_PATTERNS = ['**/build*', '**/data*', '**/dist*', "**/.git*", "**/.github*"]
+
+    # --------------------------------------------------------------------------- #
+    # Adds one docker_app_files entry to the manifest.  A file goes to the
+    # context root under its own name, or to `target` for [src, target] (inside
+    # it when target is a directory).  A directory's contents are merged into
+    # the context root, following symlinks, skipping dangling ones and paths
+    # matching DOCKER_IGNORE_PATTERNS, the directory's .dockerignore and
+    # docker_ignore, in that order.
     # @emitter()
-    def _copy_from(self, copy_src):
-        tgt = self._build_context_fp
+    def _manifest_add(self, manifest, copy_src):
+        tgt = None
         if type(copy_src) is list:
             src = copy_src[0]
-            tgt += f"/{copy_src[1]}"
+            tgt = copy_src[1]
         else:
             src = copy_src
 
         if os.path.exists(src):
             if os.path.isfile(src):
-                print(f"copy {src} -> {tgt}")
-                shutil.copy(src, tgt)
+                arcname = DockerBase._file_arcname(manifest, src, tgt)
+                print(f"add {src} -> {arcname}")
+                manifest[arcname] = src
             elif os.path.isdir(src):
-                print(f"copytree {src} -> {self._build_context_fp}")
-                shutil.copytree(src, self._build_context_fp,
-                                symlinks=False, ignore_dangling_symlinks=True, dirs_exist_ok=True,
-                                ignore=shutil.ignore_patterns('build*', 'data*', 'dist*', ".git*", ".github*"))
+                print(f"add {src} -> .")
+                DockerBase._manifest_add_tree(manifest, src, "", self._docker_ignore_for(src))
             else:
                 print(f"WARN: ignored {src} (exists, not file, not dir)")
                 return False
@@ -353,17 +978,216 @@ class DockerBase:
 
         return True
 
+    @staticmethod
+    def _file_arcname(manifest, src, tgt):
+        if tgt is None:
+            return os.path.basename(src)
+        arcname = os.path.normpath(tgt).replace(os.sep, "/").lstrip("/")
+        if arcname == "." or tgt.endswith(("/", os.sep)) or os.path.isdir(manifest.get(arcname, "")):
+            return os.path.basename(src) if arcname == "." else f"{arcname}/{os.path.basename(src)}"
+        return arcname
+
+    def _docker_ignore_for(self, src_dir):
+        ignore = DockerIgnore(DockerBase.DOCKER_IGNORE_PATTERNS)
+        dockerignore = os.path.join(src_dir, ".dockerignore")
+        if os.path.isfile(dockerignore):
+            patterns = read_dockerignore(dockerignore)
+            print(f"ignore {len(patterns)} patterns from {dockerignore}")
+            ignore.add(patterns)
+        return ignore.add(self._docker_ignore)
+
+    # --------------------------------------------------------------------------- #
+    # Walks src_dir into the manifest.  Excluded directories are not entered
+    # unless a ! pattern may re-include something below them, and then only
+    # the re-included entries are added.
+    @staticmethod
+    def _manifest_add_tree(manifest, src_dir, prefix, ignore):
+        with os.scandir(src_dir) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+        for entry in entries:
+            arcname = f"{prefix}{entry.name}"
+            if entry.is_dir():
+                if ignore.excludes_dir(arcname):
+                    continue
+                if not ignore.matches(arcname):
+                    manifest[arcname] = entry.path
+                DockerBase._manifest_add_tree(manifest, entry.path, f"{arcname}/", ignore)
+            elif not ignore.matches(arcname) and os.path.exists(entry.path):
+                manifest[arcname] = entry.path
+
+    # --------------------------------------------------------------------------- #
+    # Makes `target` hold exactly the manifest, rsync style.  A file is copied
+    # when the copy's size differs, or its mtime differs and so does its
+    # content; otherwise only mtime and mode are brought in line.  Anything
+    # in `target` that is not in the manifest is deleted.  Returns the number
+    # of files copied and entries deleted.
+    @staticmethod
+    def _sync_context(manifest, target):
+        index = digest_index()
+        copied = deleted = 0
+        os.makedirs(target, exist_ok=True)
+        keep = set()
+        for arcname, source in manifest.items():
+            parts = arcname.split("/")
+            keep.update("/".join(parts[:i]) for i in range(1, len(parts) + 1))
+            dest = os.path.join(target, *parts)
+
+            if isinstance(source, bytes):
+                if not os.path.isfile(dest) or os.path.getsize(dest) != len(source) or _read_bytes(dest) != source:
+                    _remove(dest)
+                    os.makedirs(os.path.dirname(dest), exist_ok=True)
+                    with io.open(dest, 'wb') as f:
+                        f.write(source)
+                    copied += 1
+                continue
+
+            st = os.stat(source)
+            if stat.S_ISDIR(st.st_mode):
+                if not os.path.isdir(dest) or os.path.islink(dest):
+                    _remove(dest)
+                    os.makedirs(dest)
+                if stat.S_IMODE(os.stat(dest).st_mode) != stat.S_IMODE(st.st_mode):
+                    os.chmod(dest, stat.S_IMODE(st.st_mode))
+                continue
+
+            try:
+                dst = os.lstat(dest)
+            except FileNotFoundError:
+                dst = None
+            if (dst is None or not stat.S_ISREG(dst.st_mode) or dst.st_size != st.st_size
+                    or (dst.st_mtime_ns != st.st_mtime_ns and index.digest(dest) != index.digest(source))):
+                _remove(dest)
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                shutil.copy2(source, dest)
+                copied += 1
+            else:
+                if dst.st_mtime_ns != st.st_mtime_ns:
+                    os.utime(dest, ns=(st.st_atime_ns, st.st_mtime_ns))
+                if stat.S_IMODE(dst.st_mode) != stat.S_IMODE(st.st_mode):
+                    os.chmod(dest, stat.S_IMODE(st.st_mode))
+
+        for root, dirs, files in os.walk(target, topdown=False):
+            rel_root = os.path.relpath(root, target).replace(os.sep, "/")
+            prefix = "" if rel_root == "." else f"{rel_root}/"
+            for name in files + dirs:
+                if f"{prefix}{name}" not in keep:
+                    _remove(os.path.join(root, name))
+                    deleted += 1
+        index.save()
+        return copied, deleted
+
+    # --------------------------------------------------------------------------- #
+    # Writes the manifest as a tar stream to `fileobj`, compressed with
+    # (mode, level) from parse_compression, and closes `fileobj`.  The sizes
+    # before and after compression go in `stats` ("raw", "compressed") and
+    # the compression used in stats["compression"].
+    @staticmethod
+    def _write_context(manifest, fileobj, compression=("gzip", 6), stats=None):
+        if stats is None:
+            stats = {}
+        mode, level = compression
+        stats["compression"] = mode if level is None else f"{mode}:{level}"
+        compressed = CountingWriter(fileobj)
+        raw = None
+        try:
+            with fileobj, open_compressor(compressed, mode, level) as compressor:
+                raw = CountingWriter(compressor)
+                with tarfile.open(fileobj=raw, mode="w|", dereference=True) as tar:
+                    for arcname, source in manifest.items():
+                        if isinstance(source, bytes):
+                            info = tarfile.TarInfo(arcname)
+                            info.size = len(source)
+                            info.mode = 0o644
+                            info.mtime = int(time())
+                            tar.addfile(info, io.BytesIO(source))
+                            continue
+                        info = tar.gettarinfo(source, arcname)
+                        info.uid = info.gid = 0
+                        info.uname = info.gname = ""
+                        if info.isreg():
+                            with io.open(source, 'rb') as f:
+                                tar.addfile(info, f)
+                        else:
+                            tar.addfile(info)
+        finally:
+            stats["raw"] = raw.count if raw is not None else 0
+            stats["compressed"] = compressed.count
+
     def _exec(self, cmd):
         return exec_cmd(cmd, no_sudo=is_dev_environment(), return_tuple=True)
 
+    async def _aexec(self, cmd):
+        return await aexec_cmd(cmd, no_sudo=is_dev_environment(), return_tuple=True)
 
+    # --------------------------------------------------------------------------- #
+    # like _exec but prints output as it arrives, for long running commands.
+    # Returns the last lines of stdout (not all of it) and the exit code.
+    def _exec_stream(self, cmd, timeout=None, idle_timeout=None, send_to_stdin=None):
+        stream = exec_cmd_stream(cmd, no_sudo=is_dev_environment(), timeout=timeout, idle_timeout=idle_timeout,
+                                 send_to_stdin=send_to_stdin)
+        print(stream.cmd)
+        for name, line in stream:
+            if name == CommandStream.STDERR:
+                print(f"{Colors.red}{line}{Colors.end}")
+            else:
+                print(line)
+        return "\n".join(stream.stdout_tail), stream.returncode
+
+
+def _read_bytes(path):
+    with io.open(path, 'rb') as f:
+        return f.read()
+
+
+_context_dir_locks = {}
+_context_dir_locks_lock = threading.Lock()
+
+
+# --------------------------------------------------------------------------- #
+# Held while a build context directory is synced and built from, so builds
+# sharing a directory take turns: a lock per directory within the process
+# and, where fcntl is available, a lock file next to it across processes.
+@contextlib.contextmanager
+def _context_dir_lock(path):
+    path = os.path.abspath(path)
+    with _context_dir_locks_lock:
+        lock = _context_dir_locks.setdefault(path, threading.Lock())
+    with lock:
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with io.open(f"{path}.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _remove(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+# --------------------------------------------------------------------------- #
+# A set of apps on one docker network.  Apps start in the order they were
+# added and stop in the reverse order, each starting once the apps named in
+# its depends_on are started and pass their readiness probes.  The first app
+# to fail stops the rest from being started (or stopped, or built) and its
+# exception is raised.  Opt in to
+# concurrency with parallelism > 1: then apps not ordered by depends_on start
+# (and stop and build) at the same time, at most `parallelism` at once.
 class DockerSystem:
-    def __init__(self, name: str, apps: list[DockerBase] = None ):
+    def __init__(self, name: str, apps: list[DockerBase] = None, parallelism=1):
         self._name = name
         self._network = DockerNetwork(f"{name}-net", DockerNetwork.DEFAULT_DRIVER)
         self._apps = []
         if apps is None:
             apps = []
+        self._parallelism = parallelism
 
         # host connectivity
         self._host_name = socket.gethostname()
@@ -375,14 +1199,96 @@ class DockerSystem:
     def set_network_driver(self, driver):
         self._network.set_driver(driver)
 
+    def set_parallelism(self, parallelism):
+        self._parallelism = parallelism
+
     def add_app(self, app: DockerBase):
         app.set_sys_name(self._name)
         app.set_host_name(self._host_name)
         app.set_docker_network(self._network)
         self._apps.append(app)
 
+    # --------------------------------------------------------------------------- #
+    # builds every app's image concurrently
+    def build(self, no_cache=False):
+        tasks = {app.get_docker_container_name(): (lambda app=app: app.build(no_cache)) for app in self._apps}
+        self._report("build", run_dag(tasks, {}, self._parallelism, fail_fast=True))
+
+    # --------------------------------------------------------------------------- #
+    # starts the apps and returns once every one of them is ready
     def start(self):
         self._network.create()
+
+        def start_task(app):
+            def start():
+                app.start()
+                app.wait_ready()
+            return start
+
+        tasks = {app.get_docker_container_name(): start_task(app) for app in self._apps}
+        self._report("start", run_dag(tasks, self._depends_on(), self._parallelism, fail_fast=True))
+        return self._nfo()
+
+    def stop(self):
+        tasks = {app.get_docker_container_name(): app.stop for app in reversed(self._apps)}
+        self._report("stop", run_dag(tasks, self._depends_on(reverse=True), self._parallelism, fail_fast=True))
+        self._network.destroy()
+
+    # --------------------------------------------------------------------------- #
+    # asyncio versions of build, start and stop
+    async def abuild(self, no_cache=False):
+        tasks = {app.get_docker_container_name(): (lambda app=app: asyncio.to_thread(app.build, no_cache))
+                 for app in self._apps}
+        self._report("build", await arun_dag(tasks, {}, self._parallelism, fail_fast=True))
+
+    async def astart(self):
+        await self._network.acreate()
+
+        def start_task(app):
+            async def start():
+                await app.astart()
+                await asyncio.to_thread(app.wait_ready)
+            return start
+
+        tasks = {app.get_docker_container_name(): start_task(app) for app in self._apps}
+        self._report("start", await arun_dag(tasks, self._depends_on(), self._parallelism, fail_fast=True))
+        return self._nfo()
+
+    async def astop(self):
+        tasks = {app.get_docker_container_name(): app.astop for app in reversed(self._apps)}
+        self._report("stop", await arun_dag(tasks, self._depends_on(reverse=True), self._parallelism, fail_fast=True))
+        await self._network.adestroy()
+
+    # --------------------------------------------------------------------------- #
+    # {container name: [container names it waits for]} from the apps'
+    # depends_on, reversed for stopping
+    def _depends_on(self, reverse=False):
+        by_name = {}
+        for app in self._apps:
+            by_name.setdefault(app.get_name(), []).append(app.get_docker_container_name())
+
+        depends_on = {app.get_docker_container_name(): [] for app in self._apps}
+        for app in self._apps:
+            for name in app.get_depends_on():
+                if name not in by_name:
+                    raise Exception(f"{app.get_name()} depends on '{name}', which is not part of {self._name}")
+                for dep in by_name[name]:
+                    if reverse:
+                        depends_on[dep].append(app.get_docker_container_name())
+                    else:
+                        depends_on[app.get_docker_container_name()].append(dep)
+        return depends_on
+
+    def _report(self, phase, results):
+        for r in results.values():
+            color = Colors.grn if r.status == TaskResult.OK else Colors.red
+            error = f" {r.error}" if r.error else ""
+            print(f"{phase} {r.name}: {color}{r.status}{Colors.end} {r.elapsed:.2f}s{error}")
+        for r in results.values():
+            if r.status == TaskResult.FAILED:
+                raise r.error
+
+    def _nfo(self):
         nfo = {
             "name": self._name,
             "host": {
@@ -391,12 +1297,5 @@ class DockerSystem:
             }
         }
         for app in self._apps:
-            app.start()
             nfo[app.get_name()] = app.get_port()
         return nfo
-
-    def stop(self):
-        for app in self._apps:
-            app.stop()
-        self._network.destroy()
-
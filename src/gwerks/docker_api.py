@@ -0,0 +1,228 @@
+import os
+import json
+import socket
+import threading
+import http.client
+import urllib.parse
+
+from gwerks.decorators import emitter
+
+
+# --------------------------------------------------------------------------- #
+# raised for error responses from the Docker Engine API
+class DockerApiException(Exception):
+    def __init__(self, status, message):
+        super().__init__(f"ERROR: [{status}] {message}")
+        self.status = status
+        self.message = message
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+# --------------------------------------------------------------------------- #
+# Talks HTTP/1.1 to the Docker Engine API on its unix socket instead of
+# starting the docker CLI for every operation.  Each thread keeps one
+# keep-alive connection.  api_version, e.g. "v1.41", pins the API version;
+# by default the daemon's own version is used.
+class DockerApi:
+
+    DEFAULT_SOCKET = "/var/run/docker.sock"
+
+    def __init__(self, socket_path=None, api_version=None, timeout=60):
+        self.socket_path = socket_path or DockerApi.DEFAULT_SOCKET
+        self.api_version = api_version
+        self.timeout = timeout
+        self._local = threading.local()
+
+    # --------------------------------------------------------------------------- #
+    # True if the socket exists and we may use it (otherwise use the CLI, e.g.
+    # with sudo)
+    def available(self):
+        return hasattr(socket, "AF_UNIX") and os.access(self.socket_path, os.R_OK | os.W_OK)
+
+    def ping(self):
+        try:
+            status, body = self._request("GET", "/_ping")
+        except (OSError, DockerApiException):
+            return False
+        return status == 200
+
+    # --------------------------------------------------------------------------- #
+    # networks
+    def network_inspect(self, name):
+        status, body = self._request("GET", f"/networks/{_quote(name)}", ok=(200, 404))
+        return None if status == 404 else body
+
+    def network_create(self, name, driver):
+        status, body = self._request("POST", "/networks/create", body={"Name": name, "Driver": driver},
+                                     ok=(201,))
+        return body["Id"]
+
+    # removes the network, if it exists
+    def network_remove(self, name):
+        self._request("DELETE", f"/networks/{_quote(name)}", ok=(204, 404))
+
+    # --------------------------------------------------------------------------- #
+    # images
+    def image_inspect(self, name):
+        status, body = self._request("GET", f"/images/{_quote(name)}/json", ok=(200, 404))
+        return None if status == 404 else body
+
+    # --------------------------------------------------------------------------- #
+    # containers
+    def containers(self, all=True, filters=None):
+        query = {"all": "1" if all else "0"}
+        if filters:
+            query["filters"] = json.dumps(filters)
+        status, body = self._request("GET", "/containers/json", query)
+        return body
+
+    def container_create(self, name, config):
+        status, body = self._request("POST", "/containers/create", {"name": name}, body=config, ok=(201,))
+        return body["Id"]
+
+    def container_start(self, name):
+        self._request("POST", f"/containers/{_quote(name)}/start", ok=(204, 304))
+
+    # removes the container, if it exists
+    def container_remove(self, name, force=True):
+        self._request("DELETE", f"/containers/{_quote(name)}", {"force": "1" if force else "0"}, ok=(204, 404))
+
+    # --------------------------------------------------------------------------- #
+    # what `docker system prune -f` removes: stopped containers, unused
+    # networks, dangling images and the build cache
+    def prune(self):
+        for path in ("/containers/prune", "/networks/prune", "/images/prune", "/build/prune"):
+            self._request("POST", path)
+
+    # --------------------------------------------------------------------------- #
+    # Builds an image with the classic builder from a tar build context, given
+    # as bytes, a binary file or an iterable of bytes (sent chunked).  Yields
+    # the daemon's progress messages (dicts) as they arrive and raises
+    # DockerApiException if the build fails.  BuildKit (version=2) isn't
+    # offered since it needs a gRPC session with the client.
+    def build(self, context, tag, buildargs=None, nocache=False, labels=None, dockerfile="Dockerfile"):
+        query = {"t": tag, "dockerfile": dockerfile, "rm": "1", "version": "1"}
+        if nocache:
+            query["nocache"] = "1"
+        if buildargs:
+            query["buildargs"] = json.dumps(buildargs)
+        if labels:
+            query["labels"] = json.dumps(labels)
+        headers = {"Content-Type": "application/x-tar"}
+
+        # a connection of its own, without a timeout since build steps can be
+        # silent for a long time
+        conn = _UnixHTTPConnection(self.socket_path)
+        try:
+            response = self._send(conn, "POST", self._url("/build", query), context, headers)
+            if response.status != 200:
+                raise DockerApiException(response.status, _error_message(response.read()))
+            for line in iter(response.readline, b""):
+                line = line.strip()
+                if not line:
+                    continue
+                message = json.loads(line)
+                if "error" in message:
+                    raise DockerApiException(response.status, message["error"])
+                yield message
+        finally:
+            conn.close()
+
+    # --------------------------------------------------------------------------- #
+    # Yields the daemon's events (dicts) as they happen, until the daemon goes
+    # away or the caller stops iterating.  filters is e.g. {"type": ["network"]}
+    def events(self, filters=None):
+        query = {}
+        if filters:
+            query["filters"] = json.dumps(filters)
+        conn = _UnixHTTPConnection(self.socket_path)
+        try:
+            conn.request("GET", self._url("/events", query))
+            response = conn.getresponse()
+            if response.status != 200:
+                raise DockerApiException(response.status, _error_message(response.read()))
+            for line in iter(response.readline, b""):
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+        finally:
+            conn.close()
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    # --------------------------------------------------------------------------- #
+    # one request/response on this thread's connection, returns (status, JSON
+    # body or None) and raises DockerApiException for statuses not in `ok`
+    @emitter(override_func_name="docker_api")
+    def _request(self, method, path, query=None, body=None, ok=(200,)):
+        url = self._url(path, query)
+        print(f"{method} {url}")
+        headers = {}
+        if body is not None:
+            body = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+
+        try:
+            try:
+                response = self._send(self._connection(), method, url, body, headers)
+                data = response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # the daemon closed the idle keep-alive connection, retry once on a new one
+                self.close()
+                response = self._send(self._connection(), method, url, body, headers)
+                data = response.read()
+        except BaseException:
+            self.close()
+            raise
+
+        print(f"[{response.status}]")
+        if response.status not in ok:
+            raise DockerApiException(response.status, _error_message(data))
+        if data and response.getheader("Content-Type", "").startswith("application/json"):
+            return response.status, json.loads(data)
+        return response.status, None
+
+    @staticmethod
+    def _send(conn, method, url, body, headers):
+        encode_chunked = body is not None and not isinstance(body, (bytes, bytearray))
+        conn.request(method, url, body=body, headers=headers, encode_chunked=encode_chunked)
+        return conn.getresponse()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = _UnixHTTPConnection(self.socket_path, self.timeout)
+        return conn
+
+    def _url(self, path, query=None):
+        if self.api_version:
+            path = f"/{self.api_version}{path}"
+        if query:
+            path += f"?{urllib.parse.urlencode(query)}"
+        return path
+
+
+def _quote(name):
+    return urllib.parse.quote(name, safe="")
+
+
+def _error_message(data):
+    try:
+        return json.loads(data)["message"]
+    except (ValueError, KeyError, TypeError):
+        return data.decode(errors="replace").strip()
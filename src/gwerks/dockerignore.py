@@ -0,0 +1,155 @@
+import io
+import os
+import re
+import posixpath
+
+# --------------------------------------------------------------------------- #
+# .dockerignore patterns, with Docker's semantics:
+#   *, ?, [...]   match within one path component
+#   **            matches any number of components, including none
+#   !pattern      re-includes what earlier patterns excluded
+# Paths are relative to the context root, "/"-separated.  A pattern that
+# matches a directory matches everything under it, and the last pattern
+# matching a path decides.
+# --------------------------------------------------------------------------- #
+
+
+# --------------------------------------------------------------------------- #
+# the patterns in a .dockerignore file, without blank lines and comments
+def read_dockerignore(path):
+    patterns = []
+    with io.open(path, encoding="utf-8-sig") as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                patterns.append(line)
+    return patterns
+
+
+# --------------------------------------------------------------------------- #
+# Patterns compiled once to regular expressions.  A pattern without ** only
+# matches paths with as many components as it has, so only that ancestor of
+# a path is tried against it.  excludes_dir() tells a walk when it can skip
+# a directory without looking inside it.
+class DockerIgnore:
+
+    def __init__(self, patterns=()):
+        self._patterns = []
+        self.add(patterns)
+
+    def add(self, patterns):
+        for pattern in patterns:
+            compiled = _Pattern.compile(pattern)
+            if compiled is not None:
+                self._patterns.append(compiled)
+        self._negated = [p for p in self._patterns if p.negated]
+        return self
+
+    def __bool__(self):
+        return bool(self._patterns)
+
+    # --------------------------------------------------------------------------- #
+    # True if `path` is left out of the context
+    def matches(self, path):
+        parts = path.split("/")
+        for pattern in reversed(self._patterns):
+            if pattern.match(parts):
+                return not pattern.negated
+        return False
+
+    # --------------------------------------------------------------------------- #
+    # True if `path`, a directory, and everything under it is left out, i.e.
+    # it is excluded and no ! pattern can match anything below it
+    def excludes_dir(self, path):
+        if not self.matches(path):
+            return False
+        parts = path.split("/")
+        return not any(pattern.may_match_below(parts) for pattern in self._negated)
+
+
+class _Pattern:
+
+    def __init__(self, text, negated, regex, depth, prefix):
+        self.text = text
+        self.negated = negated
+        self.regex = regex
+        self.depth = depth
+        self.prefix = prefix
+
+    @staticmethod
+    def compile(pattern):
+        text = pattern.strip()
+        negated = text.startswith("!")
+        if negated:
+            text = text[1:].strip()
+        if not text:
+            if negated:
+                raise Exception(f"illegal exclusion pattern: '{pattern}'")
+            return None
+        text = posixpath.normpath(text.replace(os.sep, "/"))
+        if len(text) > 1:
+            text = text.lstrip("/")
+
+        try:
+            regex = re.compile(_translate(text))
+            # the components before the first ** each match one path component
+            prefix = []
+            for part in text.split("/"):
+                if "**" in part:
+                    break
+                prefix.append(re.compile(_translate(part)))
+        except re.error as e:
+            raise Exception(f"bad .dockerignore pattern '{pattern}': {e}")
+        depth = None if "**" in text else text.count("/") + 1
+        return _Pattern(text, negated, regex, depth, prefix)
+
+    def match(self, parts):
+        if self.depth is not None:
+            return len(parts) >= self.depth and self.regex.fullmatch("/".join(parts[:self.depth])) is not None
+        return any(self.regex.fullmatch("/".join(parts[:i])) for i in range(1, len(parts) + 1))
+
+    # True if the pattern might match a path below the directory `parts`
+    def may_match_below(self, parts):
+        if self.depth is not None and self.depth <= len(parts):
+            return False
+        return all(part_regex.fullmatch(part) for part_regex, part in zip(self.prefix, parts))
+
+    def __repr__(self):
+        return f"{'!' if self.negated else ''}{self.text}"
+
+
+# --------------------------------------------------------------------------- #
+# a pattern as a regular expression for re.fullmatch
+def _translate(pattern):
+    regex = ""
+    i = 0
+    while i < len(pattern):
+        ch = pattern[i]
+        i += 1
+        if ch == "*":
+            if pattern.startswith("*", i):
+                i += 1
+                if pattern.startswith("/", i):
+                    i += 1
+                regex += ".*" if i == len(pattern) else "(?:.*/)?"
+            else:
+                regex += "[^/]*"
+        elif ch == "?":
+            regex += "[^/]"
+        elif ch == "\\":
+            if i == len(pattern):
+                raise re.error("trailing backslash")
+            regex += re.escape(pattern[i])
+            i += 1
+        elif ch == "[":
+            end = pattern.find("]", i + 1)
+            if end == -1:
+                raise re.error("unterminated character class")
+            chars = pattern[i:end]
+            if chars.startswith("!"):
+                chars = "^" + chars[1:]
+            regex += f"[{chars}]"
+            i = end + 1
+        else:
+            regex += re.escape(ch)
+    return regex
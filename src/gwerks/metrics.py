@@ -0,0 +1,188 @@
+import os
+import json
+import math
+import threading
+
+# --------------------------------------------------------------------------- #
+# Opt-in call counts, error counts and latency histograms for every
+# emitter-wrapped function, keyed by module and qualname.  Turn on with
+# enable_metrics() or GWERKS_METRICS=1.
+# --------------------------------------------------------------------------- #
+
+_enabled = os.environ.get("GWERKS_METRICS", "").strip().lower() in ("1", "on", "true", "yes")
+_lock = threading.Lock()
+_functions = {}
+
+
+def enable_metrics(enabled=True):
+    global _enabled
+    _enabled = bool(enabled)
+
+
+def is_enabled():
+    return _enabled
+
+
+# --------------------------------------------------------------------------- #
+# Log-bucketed latency histogram: SUB_BUCKETS buckets per doubling starting
+# at MIN_SECONDS, so every bucket is about 19% wide whatever the magnitude.
+# Values below MIN_SECONDS land in bucket 0.
+class Histogram:
+
+    SUB_BUCKETS = 4
+    MIN_SECONDS = 1e-6
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, seconds):
+        index = Histogram.bucket_index(seconds)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.sum += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    @staticmethod
+    def bucket_index(seconds):
+        if seconds <= Histogram.MIN_SECONDS:
+            return 0
+        return math.ceil(math.log2(seconds / Histogram.MIN_SECONDS) * Histogram.SUB_BUCKETS)
+
+    # the upper bound, in seconds, of the bucket
+    @staticmethod
+    def bucket_bound(index):
+        return Histogram.MIN_SECONDS * 2 ** (index / Histogram.SUB_BUCKETS)
+
+    # --------------------------------------------------------------------------- #
+    # upper bound of the bucket holding the q-th quantile (0 < q <= 1)
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(Histogram.bucket_bound(index), self.max)
+        return self.max
+
+    # --------------------------------------------------------------------------- #
+    # cumulative counts at each doubling boundary up to the max, for exporters
+    def cumulative(self):
+        result = []
+        if self.count == 0:
+            return result
+        seen = 0
+        indexes = sorted(self.counts)
+        octave = 0
+        while True:
+            bound_index = octave * Histogram.SUB_BUCKETS
+            while indexes and indexes[0] <= bound_index:
+                seen += self.counts[indexes.pop(0)]
+            result.append((Histogram.bucket_bound(bound_index), seen))
+            if not indexes:
+                return result
+            octave += 1
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+        }
+
+
+class _FunctionMetrics:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.latency = Histogram()
+
+
+# --------------------------------------------------------------------------- #
+# records one call, called by the emitter wrapper when metrics are enabled
+def record_call(mod_name, func_name, seconds, error=False):
+    key = (mod_name, func_name)
+    with _lock:
+        fm = _functions.get(key)
+        if fm is None:
+            fm = _functions[key] = _FunctionMetrics()
+        fm.calls += 1
+        if error:
+            fm.errors += 1
+        fm.latency.record(seconds)
+
+
+# --------------------------------------------------------------------------- #
+# {"module.qualname": {module, qualname, calls, errors, latency: {...}}}
+def snapshot():
+    with _lock:
+        return {f"{mod_name}.{func_name}": {
+            "module": mod_name,
+            "qualname": func_name,
+            "calls": fm.calls,
+            "errors": fm.errors,
+            "latency": fm.latency.snapshot(),
+        } for (mod_name, func_name), fm in _functions.items()}
+
+
+def reset():
+    with _lock:
+        _functions.clear()
+
+
+def export_json(indent=None):
+    return json.dumps(snapshot(), indent=indent, sort_keys=True)
+
+
+# --------------------------------------------------------------------------- #
+# Writes the metrics in Prometheus text format to `path` (e.g. for the node
+# exporter textfile collector).  The file is replaced atomically.
+def export_prometheus(path):
+    lines = [
+        "# HELP gwerks_calls_total Calls to emitter-wrapped functions.",
+        "# TYPE gwerks_calls_total counter",
+    ]
+    with _lock:
+        items = sorted(_functions.items())
+        for (mod_name, func_name), fm in items:
+            lines.append(f"gwerks_calls_total{{{_labels(mod_name, func_name)}}} {fm.calls}")
+        lines += [
+            "# HELP gwerks_errors_total Calls to emitter-wrapped functions that raised.",
+            "# TYPE gwerks_errors_total counter",
+        ]
+        for (mod_name, func_name), fm in items:
+            lines.append(f"gwerks_errors_total{{{_labels(mod_name, func_name)}}} {fm.errors}")
+        lines += [
+            "# HELP gwerks_latency_seconds Latency of emitter-wrapped functions.",
+            "# TYPE gwerks_latency_seconds histogram",
+        ]
+        for (mod_name, func_name), fm in items:
+            labels = _labels(mod_name, func_name)
+            for bound, seen in fm.latency.cumulative():
+                lines.append(f'gwerks_latency_seconds_bucket{{{labels},le="{bound:.6g}"}} {seen}')
+            lines.append(f'gwerks_latency_seconds_bucket{{{labels},le="+Inf"}} {fm.latency.count}')
+            lines.append(f"gwerks_latency_seconds_sum{{{labels}}} {fm.latency.sum:.6f}")
+            lines.append(f"gwerks_latency_seconds_count{{{labels}}} {fm.latency.count}")
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp_path, path)
+
+
+def _labels(mod_name, func_name):
+    def esc(value):
+        return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return f'module="{esc(mod_name)}",qualname="{esc(func_name)}"'
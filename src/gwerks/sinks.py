@@ -0,0 +1,199 @@
+import os
+import json
+import queue
+import atexit
+import threading
+from datetime import datetime, timezone
+
+# --------------------------------------------------------------------------- #
+# Destinations for emitter output.  A sink receives one EmitRecord per
+# non-empty message written inside an emitter-wrapped call.
+# --------------------------------------------------------------------------- #
+
+LEVEL_INFO = "INFO"
+LEVEL_WARN = "WARN"
+LEVEL_ERROR = "ERROR"
+LEVEL_SUCCESS = "SUCCESS"
+
+
+class EmitRecord:
+    __slots__ = ("time", "module", "qualname", "level", "message", "raw", "thread", "elapsed", "frame", "stream")
+
+    def __init__(self, time, module, qualname, level, message, raw, thread, elapsed, frame, stream):
+        self.time = time            # epoch seconds
+        self.module = module
+        self.qualname = qualname
+        self.level = level          # parsed from the WARN:/ERROR:/SUCCESS: message prefixes
+        self.message = message      # without the level prefix
+        self.raw = raw              # the stripped message as written
+        self.thread = thread
+        self.elapsed = elapsed      # seconds since the emitter-wrapped call started
+        self.frame = frame          # formats the console version of the message
+        self.stream = stream        # where the output would go without an emitter
+
+    def as_dict(self):
+        return {
+            "ts": datetime.fromtimestamp(self.time, timezone.utc).isoformat(),
+            "module": self.module,
+            "qualname": self.qualname,
+            "level": self.level,
+            "message": self.message,
+            "thread": self.thread,
+            "elapsed": round(self.elapsed, 6),
+        }
+
+
+def parse_level(msg):
+    if msg.startswith("WARN: "):
+        return LEVEL_WARN, msg[6:]
+    elif msg.startswith("ERROR: "):
+        return LEVEL_ERROR, msg[7:]
+    elif msg.startswith("SUCCESS: "):
+        return LEVEL_SUCCESS, msg[9:]
+    return LEVEL_INFO, msg
+
+
+class Sink:
+    def emit(self, record: EmitRecord):
+        raise Exception("emit() is not implemented")
+
+    def emit_batch(self, records):
+        for record in records:
+            self.emit(record)
+        self.flush()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+
+# --------------------------------------------------------------------------- #
+# Colorized, prefixed terminal output (the default emitter behavior).  Writes
+# to `stream`, or when None to the stream the output was originally headed for.
+class ConsoleSink(Sink):
+    def __init__(self, stream=None):
+        self._stream = stream
+
+    def emit(self, record: EmitRecord):
+        stream = self._stream if self._stream is not None else record.stream
+        stream.write(f"{record.frame.format(record.raw)}{os.linesep}")
+
+    def emit_batch(self, records):
+        if self._stream is not None:
+            self._stream.write("".join(f"{r.frame.format(r.raw)}{os.linesep}" for r in records))
+            self.flush()
+        else:
+            super().emit_batch(records)
+
+    def flush(self):
+        if self._stream is not None:
+            self._stream.flush()
+
+
+# --------------------------------------------------------------------------- #
+# One JSON object per line with ts, module, qualname, level, message, thread
+# and elapsed.  `target` is a file path (opened for append) or a text stream.
+class JsonLinesSink(Sink):
+    def __init__(self, target):
+        self._lock = threading.Lock()
+        if isinstance(target, (str, os.PathLike)):
+            self._stream = open(target, "a", encoding="utf-8")
+            self._owns_stream = True
+        else:
+            self._stream = target
+            self._owns_stream = False
+
+    def emit(self, record: EmitRecord):
+        self.emit_batch([record])
+
+    def emit_batch(self, records):
+        lines = "".join(json.dumps(r.as_dict()) + "\n" for r in records)
+        with self._lock:
+            self._stream.write(lines)
+            self._stream.flush()
+
+    def flush(self):
+        with self._lock:
+            self._stream.flush()
+
+    def close(self):
+        with self._lock:
+            self._stream.flush()
+            if self._owns_stream:
+                self._stream.close()
+
+
+# --------------------------------------------------------------------------- #
+# Hands records to a background thread through a bounded queue so emitting
+# never waits on the wrapped sink's I/O.  The thread drains up to batch_size
+# records at a time into sink.emit_batch.  When the queue is full the "drop"
+# policy discards the record (and counts it in .dropped), "block" makes the
+# caller wait for room.
+class QueuedSink(Sink):
+
+    POLICY_DROP = "drop"
+    POLICY_BLOCK = "block"
+
+    def __init__(self, sink: Sink, maxsize=10000, policy=POLICY_DROP, batch_size=256):
+        if policy not in (QueuedSink.POLICY_DROP, QueuedSink.POLICY_BLOCK):
+            raise Exception(f"policy must be one of {[QueuedSink.POLICY_DROP, QueuedSink.POLICY_BLOCK]}, "
+                            f"not '{policy}'")
+        self.sink = sink
+        self.policy = policy
+        self.batch_size = batch_size
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize)
+        self._closed = False
+        self._thread = threading.Thread(target=self._drain, name="gwerks-sink", daemon=True)
+        self._thread.start()
+        _queued_sinks.append(self)
+
+    def emit(self, record: EmitRecord):
+        if self._closed:
+            return
+        if self.policy == QueuedSink.POLICY_BLOCK:
+            self._queue.put(record)
+        else:
+            try:
+                self._queue.put_nowait(record)
+            except queue.Full:
+                self.dropped += 1
+
+    # --------------------------------------------------------------------------- #
+    # waits until everything queued so far has been written
+    def flush(self):
+        self._queue.join()
+        self.sink.flush()
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self.flush()
+            self.sink.close()
+
+    def _drain(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.sink.emit_batch(batch)
+            except Exception:
+                pass  # a failing sink must not take the writer thread down
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+
+_queued_sinks = []
+
+
+@atexit.register
+def _flush_queued_sinks():
+    for queued_sink in _queued_sinks:
+        queued_sink.close()
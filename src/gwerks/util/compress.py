@@ -0,0 +1,150 @@
+import os
+import gzip
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# --------------------------------------------------------------------------- #
+# Streaming compressors for build contexts, chosen by a "mode[:level]" string:
+#   none          no compression (the daemon is local, bytes are cheap)
+#   gzip[:level]  single-threaded gzip, level 1-9 (default 6, like tar -z)
+#   pgzip[:level] gzip compressed in parallel blocks on a thread pool
+#   zstd[:level]  zstandard, multithreaded (needs the zstandard package and a
+#                 daemon that accepts zstd contexts, Docker 20.10+)
+# --------------------------------------------------------------------------- #
+
+NONE = "none"
+GZIP = "gzip"
+PGZIP = "pgzip"
+ZSTD = "zstd"
+MODES = [NONE, GZIP, PGZIP, ZSTD]
+
+DEFAULT_LEVELS = {GZIP: 6, PGZIP: 6, ZSTD: 3}
+
+
+# --------------------------------------------------------------------------- #
+# "gzip:9" -> ("gzip", 9), raises on unknown modes or bad levels
+def parse_compression(compression):
+    mode, _, level = str(compression).strip().lower().partition(":")
+    if mode not in MODES:
+        raise Exception(f"compression must be one of {MODES} (with an optional ':level'), not '{compression}'")
+    if mode == NONE:
+        return mode, None
+    if not level:
+        return mode, DEFAULT_LEVELS[mode]
+    try:
+        level = int(level)
+    except ValueError:
+        raise Exception(f"compression level must be a number, not '{level}'")
+    max_level = 22 if mode == ZSTD else 9
+    if not 1 <= level <= max_level:
+        raise Exception(f"{mode} compression level must be between 1 and {max_level}, not {level}")
+    return mode, level
+
+
+# --------------------------------------------------------------------------- #
+# A writable that compresses into `fileobj` with `mode` at `level`, as
+# returned by parse_compression.  Closing it finishes the compressed stream
+# but leaves `fileobj` open.
+def open_compressor(fileobj, mode, level=None):
+    if mode == NONE:
+        return _Uncompressed(fileobj)
+    if mode == GZIP:
+        return gzip.GzipFile(fileobj=fileobj, mode="wb", compresslevel=level, mtime=0)
+    if mode == PGZIP:
+        return ParallelGzipWriter(fileobj, level)
+    try:
+        import zstandard
+    except ImportError:
+        raise Exception("zstd compression needs the zstandard package (pip install zstandard)")
+    return zstandard.ZstdCompressor(level=level, threads=-1).stream_writer(fileobj, closefd=False)
+
+
+# --------------------------------------------------------------------------- #
+# Counts the bytes written through it to `fileobj`.  Closing it does not
+# close `fileobj`.
+class CountingWriter:
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+        self.count = 0
+
+    def write(self, data):
+        self._fileobj.write(data)
+        self.count += len(data)
+        return len(data)
+
+    def flush(self):
+        self._fileobj.flush()
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+
+class _Uncompressed(CountingWriter):
+    pass
+
+
+# --------------------------------------------------------------------------- #
+# pigz-style gzip: the input is cut into blocks that are compressed on a
+# thread pool (zlib releases the GIL) and written in order, each as its own
+# gzip member.  Concatenated members are a valid gzip stream.  At most two
+# blocks per worker are in flight.
+class ParallelGzipWriter:
+
+    BLOCK_SIZE = 1024 * 1024
+
+    def __init__(self, fileobj, level=6, workers=None):
+        self._fileobj = fileobj
+        self._level = level
+        self._workers = workers or os.cpu_count() or 4
+        self._pool = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="gwerks-pgzip")
+        self._pending = deque()
+        self._buffer = bytearray()
+        self._members = 0
+        self._closed = False
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= ParallelGzipWriter.BLOCK_SIZE:
+            block = bytes(self._buffer[:ParallelGzipWriter.BLOCK_SIZE])
+            del self._buffer[:ParallelGzipWriter.BLOCK_SIZE]
+            self._submit(block)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            if self._buffer or self._members == 0:
+                self._submit(bytes(self._buffer))
+                self._buffer.clear()
+            while self._pending:
+                self._fileobj.write(self._pending.popleft().result())
+        finally:
+            self._pool.shutdown(cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # don't write anything more after a failure, e.g. a broken pipe
+            self._closed = True
+            self._pool.shutdown(cancel_futures=True)
+
+    def _submit(self, block):
+        self._pending.append(self._pool.submit(gzip.compress, block, self._level, mtime=0))
+        self._members += 1
+        while len(self._pending) > self._workers * 2:
+            self._fileobj.write(self._pending.popleft().result())
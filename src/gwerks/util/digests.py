@@ -0,0 +1,92 @@
+import os
+import json
+import hashlib
+import threading
+
+
+# --------------------------------------------------------------------------- #
+# gwerks' local cache directory: $XDG_CACHE_HOME/gwerks or ~/.cache/gwerks
+def cache_dir():
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "gwerks")
+
+
+# where the shared DigestIndex lives
+def default_index_path():
+    return os.path.join(cache_dir(), "digests.json")
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+# --------------------------------------------------------------------------- #
+# Remembers the sha256 of files by absolute path, keyed on size, mtime and
+# inode, so files that haven't changed aren't read again.  Persisted as JSON
+# with save(); a missing or unreadable index just means hashing from scratch.
+class DigestIndex:
+
+    def __init__(self, path=None):
+        self.path = path or default_index_path()
+        self._lock = threading.Lock()
+        self._entries = None
+        self._dirty = False
+
+    def digest(self, path):
+        st = os.stat(path)
+        key = os.path.abspath(path)
+        stamp = [st.st_size, st.st_mtime_ns, st.st_ino]
+        with self._lock:
+            self._load()
+            entry = self._entries.get(key)
+            if entry is not None and entry[:3] == stamp:
+                return entry[3]
+
+        digest = file_digest(path)
+        with self._lock:
+            self._entries[key] = stamp + [digest]
+            self._dirty = True
+        return digest
+
+    # --------------------------------------------------------------------------- #
+    # writes the index if anything changed, replacing the file atomically
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(self._entries, f, separators=(",", ":"))
+                os.replace(tmp_path, self.path)
+                self._dirty = False
+            except OSError as e:
+                print(f"WARN: could not save {self.path}: {e}")
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        try:
+            with open(self.path) as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError):
+            self._entries = {}
+
+
+_digest_index = None
+_digest_index_lock = threading.Lock()
+
+
+# --------------------------------------------------------------------------- #
+# the DigestIndex shared by the whole process
+def digest_index():
+    global _digest_index
+    with _digest_index_lock:
+        if _digest_index is None:
+            _digest_index = DigestIndex()
+        return _digest_index
@@ -0,0 +1,263 @@
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from time import monotonic
+
+from gwerks.decorators import emitter
+from gwerks.util import Colors
+from gwerks.util.sys import exec_cmd_stream, CommandStream
+
+
+# --------------------------------------------------------------------------- #
+# the outcome of one task run by run_dag
+class TaskResult:
+
+    OK = "ok"
+    FAILED = "failed"
+    SKIPPED = "skipped"
+
+    def __init__(self, name, status, result=None, error=None, elapsed=0.0):
+        self.name = name
+        self.status = status
+        self.result = result
+        self.error = error
+        self.elapsed = elapsed
+
+    def __repr__(self):
+        return f"TaskResult({self.name!r}, {self.status!r}, elapsed={self.elapsed:.2f})"
+
+
+# --------------------------------------------------------------------------- #
+# Runs {name: callable} concurrently, at most `parallelism` at a time, starting
+# each task once every task named in depends_on[name] has finished OK.
+# Dependents of a failed task are skipped, and with fail_fast so is every task
+# that hasn't started yet.  Returns {name: TaskResult} in the order the tasks
+# finished.  Tasks run in a copy of the caller's context so emitter prefixes
+# carry over into the worker threads.
+def run_dag(tasks, depends_on=None, parallelism=4, fail_fast=False):
+    if depends_on is None:
+        depends_on = {}
+    _check_dag(tasks, depends_on)
+
+    waiting_on = {name: set(depends_on.get(name, [])) for name in tasks}
+    dependents = {name: [] for name in tasks}
+    for name, deps in waiting_on.items():
+        for dep in deps:
+            dependents[dep].append(name)
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix="gwerks-dag") as pool:
+        running = {}
+        stopped_by = None
+
+        # only as many as can run, so nothing is queued that fail_fast can't hold back
+        def submit_ready():
+            for name in tasks:
+                if len(running) >= parallelism or stopped_by is not None:
+                    return
+                if name not in results and name not in running.values() and not waiting_on[name]:
+                    running[pool.submit(contextvars.copy_context().run, _timed, tasks[name])] = name
+
+        def skip(name, reason):
+            if name in results:
+                return
+            results[name] = TaskResult(name, TaskResult.SKIPPED, error=reason)
+            for dependent in dependents[name]:
+                skip(dependent, f"'{name}' was skipped")
+
+        submit_ready()
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                result, error, elapsed = future.result()
+                if error is None:
+                    results[name] = TaskResult(name, TaskResult.OK, result=result, elapsed=elapsed)
+                    for dependent in dependents[name]:
+                        waiting_on[dependent].discard(name)
+                else:
+                    results[name] = TaskResult(name, TaskResult.FAILED, error=error, elapsed=elapsed)
+                    for dependent in dependents[name]:
+                        skip(dependent, f"'{name}' failed")
+                    if fail_fast and stopped_by is None:
+                        stopped_by = name
+            submit_ready()
+
+    if stopped_by is not None:
+        for name in tasks:
+            if name not in results:
+                results[name] = TaskResult(name, TaskResult.SKIPPED, error=f"stopped after '{stopped_by}' failed")
+    return results
+
+
+# --------------------------------------------------------------------------- #
+# asyncio version of run_dag, tasks are {name: coroutine function} and run as
+# asyncio tasks, at most `parallelism` at a time
+async def arun_dag(tasks, depends_on=None, parallelism=4, fail_fast=False):
+    if depends_on is None:
+        depends_on = {}
+    _check_dag(tasks, depends_on)
+
+    semaphore = asyncio.Semaphore(parallelism)
+    results = {}
+    runs = {}
+    failures = []
+
+    async def run(name):
+        deps = depends_on.get(name, [])
+        for dep in deps:
+            await runs[dep]
+        for dep in deps:
+            if results[dep].status == TaskResult.FAILED:
+                results[name] = TaskResult(name, TaskResult.SKIPPED, error=f"'{dep}' failed")
+                return
+            if results[dep].status == TaskResult.SKIPPED:
+                results[name] = TaskResult(name, TaskResult.SKIPPED, error=f"'{dep}' was skipped")
+                return
+        async with semaphore:
+            if fail_fast and failures:
+                results[name] = TaskResult(name, TaskResult.SKIPPED, error=f"stopped after '{failures[0]}' failed")
+                return
+            start = monotonic()
+            try:
+                result = await tasks[name]()
+            except Exception as e:
+                failures.append(name)
+                results[name] = TaskResult(name, TaskResult.FAILED, error=e, elapsed=monotonic() - start)
+            else:
+                results[name] = TaskResult(name, TaskResult.OK, result=result, elapsed=monotonic() - start)
+
+    for name in tasks:
+        runs[name] = asyncio.ensure_future(run(name))
+    await asyncio.gather(*runs.values())
+    return results
+
+
+def _timed(task):
+    start = monotonic()
+    try:
+        return task(), None, monotonic() - start
+    except Exception as e:
+        return None, e, monotonic() - start
+
+
+def _check_dag(tasks, depends_on):
+    for name, deps in depends_on.items():
+        if name not in tasks:
+            raise Exception(f"depends_on given for unknown task '{name}'")
+        for dep in deps:
+            if dep not in tasks:
+                raise Exception(f"'{name}' depends on unknown task '{dep}'")
+
+    # Kahn's algorithm, anything left over is part of a cycle
+    remaining = {name: set(depends_on.get(name, [])) for name in tasks}
+    while remaining:
+        ready = [name for name, deps in remaining.items() if not deps]
+        if not ready:
+            raise Exception(f"dependency cycle between {sorted(remaining)}")
+        for name in ready:
+            del remaining[name]
+        for deps in remaining.values():
+            deps.difference_update(ready)
+
+
+# --------------------------------------------------------------------------- #
+# the outcome of one command run by CommandRunner
+class CommandResult(TaskResult):
+    def __init__(self, task_result: TaskResult, cmd):
+        super().__init__(task_result.name, task_result.status, task_result.result, task_result.error,
+                         task_result.elapsed)
+        self.cmd = cmd
+        stream = task_result.result
+        if stream is None:
+            stream = getattr(task_result.error, "stream", None)
+        self.exit_code = stream.returncode if stream is not None else None
+        self.stdout = list(stream.stdout_tail) if stream is not None else []
+        self.stderr = list(stream.stderr_tail) if stream is not None else []
+
+
+# --------------------------------------------------------------------------- #
+# structured results of a CommandRunner.run, in the order commands finished
+class RunReport:
+    def __init__(self, results: list[CommandResult], elapsed):
+        self.results = {r.name: r for r in results}
+        self.elapsed = elapsed
+
+    @property
+    def ok(self):
+        return all(r.status == TaskResult.OK for r in self.results.values())
+
+    @property
+    def failed(self):
+        return [r for r in self.results.values() if r.status == TaskResult.FAILED]
+
+    @property
+    def skipped(self):
+        return [r for r in self.results.values() if r.status == TaskResult.SKIPPED]
+
+    def raise_for_failures(self):
+        if not self.ok:
+            raise Exception(f"ERROR: {len(self.failed)} failed, {len(self.skipped)} skipped: "
+                            f"{ {r.name: str(r.error) for r in self.failed + self.skipped} }")
+
+    def summary(self):
+        lines = []
+        for r in self.results.values():
+            exit_code = "" if r.exit_code is None else f" [{r.exit_code}]"
+            lines.append(f"{r.name}: {r.status}{exit_code} {r.elapsed:.2f}s")
+        lines.append(f"total: {self.elapsed:.2f}s")
+        return "\n".join(lines)
+
+
+# --------------------------------------------------------------------------- #
+# Runs shell commands concurrently, honoring declared dependencies, with the
+# same raise_exc/no_sudo/send_to_stdin semantics as exec_cmd.  A command with
+# raise_exc=False never counts as failed, so its dependents run whatever its
+# exit code.  Output lines are printed as they arrive, prefixed with the
+# command's name, and the last `tail_lines` of each stream kept in the report.
+class CommandRunner:
+
+    def __init__(self, parallelism=4, tail_lines=1000):
+        self.parallelism = parallelism
+        self.tail_lines = tail_lines
+        self._commands = {}
+        self._depends_on = {}
+
+    def add(self, name, cmd, depends_on=(), raise_exc=True, no_sudo=True, send_to_stdin=None,
+            timeout=None, idle_timeout=None):
+        if name in self._commands:
+            raise Exception(f"command '{name}' was already added")
+        self._commands[name] = (cmd, dict(raise_exc=raise_exc, no_sudo=no_sudo, send_to_stdin=send_to_stdin,
+                                          timeout=timeout, idle_timeout=idle_timeout))
+        self._depends_on[name] = list(depends_on)
+        return self
+
+    @emitter()
+    def run(self) -> RunReport:
+        start = monotonic()
+        tasks = {name: self._task(name) for name in self._commands}
+        results = run_dag(tasks, self._depends_on, self.parallelism)
+        report = RunReport([CommandResult(r, self._commands[r.name][0]) for r in results.values()],
+                           monotonic() - start)
+        for line in report.summary().splitlines():
+            print(line)
+        return report
+
+    def _task(self, name):
+        cmd, kwargs = self._commands[name]
+
+        def run_command():
+            stream = exec_cmd_stream(cmd, tail_lines=self.tail_lines, **kwargs)
+            print(f"[{name}] {stream.cmd}")
+            try:
+                for stream_name, line in stream:
+                    if stream_name == CommandStream.STDERR:
+                        print(f"[{name}] {Colors.red}{line}{Colors.end}")
+                    else:
+                        print(f"[{name}] {line}")
+            except Exception as e:
+                e.stream = stream
+                raise e
+            return stream
+
+        return run_command
@@ -1,4 +1,14 @@
+import os
+import uuid
+import shlex
+import queue
+import atexit
+import asyncio
+import signal
+import threading
 import subprocess
+from collections import deque
+from time import monotonic
 
 from gwerks import emitter
 from gwerks.util import Colors
@@ -12,37 +22,387 @@ def sudo(no_sudo=True):
     return "sudo"
 
 
+# --------------------------------------------------------------------------- #
+# A command given as a string runs through the shell.  Given as a list it is
+# an argv run directly, without a shell (so no quoting and no fork/exec of
+# /bin/sh), with sudo prepended as its own argument.  Returns the command to
+# run and how to print it.
+def _command(cmd, no_sudo=True):
+    if isinstance(cmd, (list, tuple)):
+        argv = [str(arg) for arg in cmd]
+        if not no_sudo:
+            argv.insert(0, sudo(no_sudo))
+        return argv, shlex.join(argv)
+    cmd = f"{sudo(no_sudo)} {cmd}".strip()
+    return cmd, cmd
+
+
 # --------------------------------------------------------------------------- #
 # execute system commands, optionally raise Exceptions on non-zero exit codes
 @emitter()
 def exec_cmd(cmd, raise_exc=True, no_sudo=True, send_to_stdin=None, return_tuple=False):
-    cmd = f"{sudo(no_sudo)} {cmd}".strip()
-    print(cmd)
+    cmd, display = _command(cmd, no_sudo)
+    print(display)
 
     # Execute command and capture the output
-    result = subprocess.run(cmd, capture_output=True, text=True, shell=True, input=send_to_stdin)
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, shell=isinstance(cmd, str), input=send_to_stdin)
+    except FileNotFoundError as e:
+        # what the shell would have reported for a missing argv[0]
+        return _exec_result("", f"{e}", 127, raise_exc, return_tuple)
+
+    return _exec_result(result.stdout, result.stderr, result.returncode, raise_exc, return_tuple)
+
+
+# --------------------------------------------------------------------------- #
+# asyncio version of exec_cmd, same arguments and results.  Cancelling the
+# awaiting task kills the command's whole process group.
+@emitter()
+async def aexec_cmd(cmd, raise_exc=True, no_sudo=True, send_to_stdin=None, return_tuple=False):
+    cmd, display = _command(cmd, no_sudo)
+    print(display)
+
+    kwargs = dict(stdin=asyncio.subprocess.PIPE if send_to_stdin is not None else asyncio.subprocess.DEVNULL,
+                  stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+                  start_new_session=os.name != 'nt')
+    if isinstance(cmd, str):
+        proc = await asyncio.create_subprocess_shell(cmd, **kwargs)
+    else:
+        try:
+            proc = await asyncio.create_subprocess_exec(*cmd, **kwargs)
+        except FileNotFoundError as e:
+            return _exec_result("", f"{e}", 127, raise_exc, return_tuple)
+    try:
+        stdout, stderr = await proc.communicate(send_to_stdin.encode() if send_to_stdin is not None else None)
+    except asyncio.CancelledError:
+        _kill_group(proc)
+        await proc.wait()
+        raise
+
+    return _exec_result(_decode(stdout), _decode(stderr), proc.returncode, raise_exc, return_tuple)
+
 
-    exit_code = result.returncode
+def _kill_group(proc):
+    if proc.returncode is not None:
+        return
+    try:
+        if os.name != 'nt':
+            os.killpg(proc.pid, signal.SIGKILL)
+        else:
+            proc.kill()
+    except ProcessLookupError:
+        pass
+
+
+def _decode(output):
+    return output.decode(errors="replace").replace("\r\n", "\n")
+
+
+def _exec_result(stdout, stderr, exit_code, raise_exc, return_tuple):
     if raise_exc and exit_code != 0:
         error_msg = f"ERROR: [{exit_code}]"
-        if result.stderr:
-            error_msg += f" {result.stderr}"
+        if stderr:
+            error_msg += f" {stderr}"
         print(f"{Colors.red}error_msg{Colors.end}")
         raise Exception(error_msg)
 
     # Print the standard output and return code
-    result_msg = f"[{result.returncode}]"
-    if result.stdout:
-        result_msg += f" {result.stdout}"
+    result_msg = f"[{exit_code}]"
+    if stdout:
+        result_msg += f" {stdout}"
 
     # Print the standard error, if any
-    if result.stderr:
-        result_msg += f" {Colors.red}ERROR: {result.stderr}{Colors.end}"
+    if stderr:
+        result_msg += f" {Colors.red}ERROR: {stderr}{Colors.end}"
 
     # Print the return code
     print(result_msg)
 
     if return_tuple:
-        return result.stdout, result.returncode
+        return stdout, exit_code
     else:
-        return result.stdout
+        return stdout
+
+
+# --------------------------------------------------------------------------- #
+# raised when a streamed command runs past its wall-clock or idle timeout
+class CommandTimeoutException(Exception):
+    pass
+
+
+# --------------------------------------------------------------------------- #
+# Execute a system command and stream its output as it arrives instead of
+# buffering it all like exec_cmd does.  Iterating yields (stream, line) tuples
+# where stream is CommandStream.STDOUT or CommandStream.STDERR.  The last
+# `tail_lines` lines of each stream are kept for error reporting.  If the
+# command runs longer than `timeout` seconds, or goes `idle_timeout` seconds
+# without output, its whole process group is killed and a
+# CommandTimeoutException raised.  send_to_stdin may be a string or a callable
+# that is handed the (binary) stdin pipe on a writer thread.
+def exec_cmd_stream(cmd, raise_exc=True, no_sudo=True, send_to_stdin=None, timeout=None, idle_timeout=None,
+                    tail_lines=200):
+    return CommandStream(cmd, raise_exc, no_sudo, send_to_stdin, timeout, idle_timeout, tail_lines)
+
+
+class CommandStream:
+
+    STDOUT = "stdout"
+    STDERR = "stderr"
+
+    def __init__(self, cmd, raise_exc=True, no_sudo=True, send_to_stdin=None, timeout=None, idle_timeout=None,
+                 tail_lines=200):
+        self._args, self.cmd = _command(cmd, no_sudo)
+        self.raise_exc = raise_exc
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.returncode = None
+        self.stdout_tail = deque(maxlen=tail_lines)
+        self.stderr_tail = deque(maxlen=tail_lines)
+        self._send_to_stdin = send_to_stdin
+        self._proc = None
+
+    def __iter__(self):
+        self._proc = subprocess.Popen(
+            self._args, shell=isinstance(self._args, str),
+            stdin=subprocess.PIPE if self._send_to_stdin is not None else subprocess.DEVNULL,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            start_new_session=os.name != 'nt')
+        lines = queue.Queue()
+        readers = [
+            threading.Thread(target=self._read, args=(self._proc.stdout, CommandStream.STDOUT, lines), daemon=True),
+            threading.Thread(target=self._read, args=(self._proc.stderr, CommandStream.STDERR, lines), daemon=True),
+        ]
+        if self._send_to_stdin is not None:
+            readers.append(threading.Thread(target=self._write, args=(self._proc.stdin,), daemon=True))
+        for t in readers:
+            t.start()
+
+        start = last_output = monotonic()
+        open_streams = 2
+        try:
+            while open_streams:
+                # checked on every line too, a command that never stops
+                # writing must still time out
+                self._check_timeouts(start, last_output)
+                try:
+                    item = lines.get(timeout=self._wait_time(start, last_output))
+                except queue.Empty:
+                    continue
+                if item is None:
+                    open_streams -= 1
+                    continue
+                last_output = monotonic()
+                stream, line = item
+                if stream == CommandStream.STDOUT:
+                    self.stdout_tail.append(line)
+                else:
+                    self.stderr_tail.append(line)
+                yield item
+                self._check_timeouts(start, last_output)
+
+            self.returncode = self._proc.wait()
+        finally:
+            if self.returncode is None:
+                # timed out, failed or the caller stopped iterating early
+                self.kill()
+                self.returncode = self._proc.wait()
+
+        if self.raise_exc and self.returncode != 0:
+            error_msg = f"ERROR: [{self.returncode}]"
+            if self.stderr_tail:
+                error_msg += " " + "\n".join(self.stderr_tail)
+            raise Exception(error_msg)
+
+    # --------------------------------------------------------------------------- #
+    # kills the command and everything it started
+    def kill(self):
+        if self._proc is None or self._proc.poll() is not None:
+            return
+        try:
+            if os.name != 'nt':
+                os.killpg(self._proc.pid, signal.SIGKILL)
+            else:
+                self._proc.kill()
+        except ProcessLookupError:
+            pass
+
+    def _wait_time(self, start, last_output):
+        waits = []
+        if self.timeout is not None:
+            waits.append(self.timeout - (monotonic() - start))
+        if self.idle_timeout is not None:
+            waits.append(self.idle_timeout - (monotonic() - last_output))
+        if not waits:
+            return None
+        return max(min(waits), 0.01)
+
+    def _check_timeouts(self, start, last_output):
+        now = monotonic()
+        if self.timeout is not None and now - start >= self.timeout:
+            self.kill()
+            raise CommandTimeoutException(f"ERROR: '{self.cmd}' ran longer than {self.timeout}s")
+        if self.idle_timeout is not None and now - last_output >= self.idle_timeout:
+            self.kill()
+            raise CommandTimeoutException(f"ERROR: '{self.cmd}' produced no output for {self.idle_timeout}s")
+
+    @staticmethod
+    def _read(pipe, stream, lines):
+        with pipe:
+            for raw in iter(pipe.readline, b''):
+                lines.put((stream, raw.decode('utf-8', errors='replace').rstrip('\r\n')))
+        lines.put(None)
+
+    def _write(self, pipe):
+        try:
+            with pipe:
+                if callable(self._send_to_stdin):
+                    self._send_to_stdin(pipe)
+                else:
+                    pipe.write(self._send_to_stdin.encode('utf-8'))
+        except BrokenPipeError:
+            pass  # the command exited without reading all of its input
+
+
+# --------------------------------------------------------------------------- #
+# One long-lived bash fed commands over stdin, for bursts of small commands
+# where starting a shell per command costs more than the command itself.
+# run() takes the same arguments and returns the same results as exec_cmd
+# (string or argv commands, but no stdin; commands read /dev/null).  Each
+# command starts in the caller's current directory with the caller's
+# environment; variables and functions it defines persist in the session.
+# Output and the exit code are delimited by a per-session sentinel line.
+# Commands run one at a time.  If a command exits the shell or times out,
+# the next command starts a new shell.
+class ShellSession:
+
+    def __init__(self, shell="bash"):
+        self.shell = shell
+        self._lock = threading.Lock()
+        self._proc = None
+        self._sentinel = None
+        self._stdout = None
+        self._stderr = None
+        self._environ = None
+
+    @emitter()
+    def run(self, cmd, raise_exc=True, no_sudo=True, return_tuple=False, timeout=None):
+        cmd, display = _command(cmd, no_sudo)
+        print(display)
+        with self._lock:
+            stdout, stderr, exit_code = self._run(display, timeout)
+        return _exec_result(stdout, stderr, exit_code, raise_exc, return_tuple)
+
+    def close(self):
+        with self._lock:
+            self._stop()
+
+    def _run(self, cmd, timeout):
+        if self._proc is None or self._proc.poll() is not None:
+            self._start()
+
+        # the command is handed to eval as one quoted word, so unbalanced
+        # quotes in it are a syntax error instead of eating the sentinels
+        script = self._sync_environ()
+        script += f"cd {shlex.quote(os.getcwd())} && eval {shlex.quote(cmd)} </dev/null\n"
+        script += f"printf '\\n%s %d\\n' {self._sentinel} $?\n"
+        script += f"printf '\\n%s\\n' {self._sentinel} >&2\n"
+        try:
+            self._proc.stdin.write(script.encode())
+            self._proc.stdin.flush()
+        except BrokenPipeError:
+            pass  # the shell is gone, reading below picks up its exit code
+
+        deadline = None if timeout is None else monotonic() + timeout
+        stdout, marker = self._read_until(self._stdout, deadline, cmd, timeout)
+        stderr, _ = self._read_until(self._stderr, deadline, cmd, timeout)
+        if marker is None:
+            # the shell exited before finishing the command
+            exit_code = self._proc.wait()
+            self._stop()
+        else:
+            exit_code = int(marker.split()[1])
+        return stdout, stderr, exit_code
+
+    # --------------------------------------------------------------------------- #
+    # collects lines up to the sentinel (dropping the newline printed before
+    # it), returns the text and the sentinel line or None if the shell exited
+    def _read_until(self, lines, deadline, cmd, timeout):
+        text = []
+        while True:
+            try:
+                line = lines.get(timeout=None if deadline is None else max(deadline - monotonic(), 0))
+            except queue.Empty:
+                self._stop()
+                raise CommandTimeoutException(f"ERROR: '{cmd}' ran longer than {timeout}s")
+            if line is None:
+                return "".join(text), None
+            if line.startswith(self._sentinel):
+                output = "".join(text)
+                return (output[:-1] if output.endswith("\n") else output), line
+            text.append(line)
+
+    # --------------------------------------------------------------------------- #
+    # shell lines that bring the session's environment in line with os.environ
+    def _sync_environ(self):
+        script = ""
+        current = dict(os.environ)
+        for name in self._environ.keys() - current.keys():
+            if name.isidentifier():
+                script += f"unset {name}\n"
+        for name, value in current.items():
+            if self._environ.get(name) != value and name.isidentifier():
+                script += f"export {name}={shlex.quote(value)}\n"
+        self._environ = current
+        return script
+
+    def _start(self):
+        self._stop()
+        self._sentinel = f"__gwerks_{uuid.uuid4().hex}__"
+        self._environ = dict(os.environ)
+        self._proc = subprocess.Popen(
+            [self.shell], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            start_new_session=os.name != 'nt')
+        self._stdout = queue.Queue()
+        self._stderr = queue.Queue()
+        for pipe, lines in ((self._proc.stdout, self._stdout), (self._proc.stderr, self._stderr)):
+            threading.Thread(target=ShellSession._read, args=(pipe, lines), name="gwerks-shell", daemon=True).start()
+
+    def _stop(self):
+        if self._proc is None:
+            return
+        try:
+            self._proc.stdin.close()
+        except OSError:
+            pass
+        if self._proc.poll() is None:
+            try:
+                if os.name != 'nt':
+                    os.killpg(self._proc.pid, signal.SIGKILL)
+                else:
+                    self._proc.kill()
+            except ProcessLookupError:
+                pass
+        self._proc.wait()
+        self._proc = None
+
+    @staticmethod
+    def _read(pipe, lines):
+        with pipe:
+            for raw in iter(pipe.readline, b''):
+                lines.put(raw.decode('utf-8', errors='replace').replace('\r\n', '\n'))
+        lines.put(None)
+
+
+_shell_session = None
+_shell_session_lock = threading.Lock()
+
+
+# --------------------------------------------------------------------------- #
+# the ShellSession shared by the whole process, started on first use
+def shell_session():
+    global _shell_session
+    with _shell_session_lock:
+        if _shell_session is None:
+            _shell_session = ShellSession()
+            atexit.register(_shell_session.close)
+        return _shell_session
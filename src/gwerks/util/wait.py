@@ -0,0 +1,172 @@
+import heapq
+import random
+import threading
+from itertools import count
+from time import monotonic
+
+
+# --------------------------------------------------------------------------- #
+# raised by poll() checks to mean "not done yet, poll again"
+class NotReady(Exception):
+    pass
+
+
+# --------------------------------------------------------------------------- #
+# raised by poll() when the backoff policy gives up
+class WaitTimeout(Exception):
+    def __init__(self, phase, elapsed, last_exc=None):
+        super().__init__(f"gave up waiting on {phase} after {elapsed:.1f}s: {last_exc}")
+        self.phase = phase
+        self.elapsed = elapsed
+        self.last_exc = last_exc
+
+
+# --------------------------------------------------------------------------- #
+# Exponential backoff with jitter.  The first poll happens after `first`
+# seconds, the next after `initial`, then each delay grows by `factor` up to
+# `maximum`.  Every delay is randomized by +/- `jitter` (a fraction) so many
+# waiters don't poll in lock step.  Gives up after `attempts` polls and/or
+# once `timeout` seconds have passed.
+class Backoff:
+    def __init__(self, first=0.0, initial=1.0, factor=2.0, maximum=30.0, jitter=0.2, timeout=None, attempts=None):
+        self.first = first
+        self.initial = initial
+        self.factor = factor
+        self.maximum = maximum
+        self.jitter = jitter
+        self.timeout = timeout
+        self.attempts = attempts
+
+    # --------------------------------------------------------------------------- #
+    # the delay to sleep before poll number `attempt` (0 based)
+    def delay(self, attempt):
+        if attempt == 0:
+            base = self.first
+        else:
+            base = min(self.initial * (self.factor ** (attempt - 1)), self.maximum)
+        if self.jitter:
+            base *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        return max(base, 0.0)
+
+    # --------------------------------------------------------------------------- #
+    # True if another poll is allowed after `attempt` polls and `elapsed` seconds
+    def allows(self, attempt, elapsed):
+        if self.attempts is not None and attempt >= self.attempts:
+            return False
+        if self.timeout is not None and elapsed >= self.timeout:
+            return False
+        return True
+
+
+# --------------------------------------------------------------------------- #
+# One timer thread shared by every waiter in the process.  Waiters park on an
+# Event and the thread wakes them from a heap of deadlines, so hundreds of
+# instances waiting at once cost one thread plus an Event each.
+class Scheduler:
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._heap = []
+        self._seq = count()
+        self._thread = None
+
+    def sleep(self, seconds):
+        if seconds <= 0:
+            return
+        wake = threading.Event()
+        with self._cond:
+            heapq.heappush(self._heap, (monotonic() + seconds, next(self._seq), wake))
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="gwerks-scheduler", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        wake.wait()
+
+    # --------------------------------------------------------------------------- #
+    # wakes every waiter now, e.g. when shutting down
+    def wake_all(self):
+        with self._cond:
+            while self._heap:
+                heapq.heappop(self._heap)[2].set()
+
+    def _run(self):
+        with self._cond:
+            while True:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                deadline, _, wake = self._heap[0]
+                remaining = deadline - monotonic()
+                if remaining > 0:
+                    self._cond.wait(remaining)
+                    continue
+                heapq.heappop(self._heap)
+                wake.set()
+
+
+_scheduler = Scheduler()
+
+
+# --------------------------------------------------------------------------- #
+# per-phase wait instrumentation
+_stats_lock = threading.Lock()
+_stats = {}
+
+
+def _record(phase, polls, waited, elapsed):
+    with _stats_lock:
+        s = _stats.setdefault(phase, {"calls": 0, "polls": 0, "waited": 0.0, "elapsed": 0.0})
+        s["calls"] += 1
+        s["polls"] += polls
+        s["waited"] += waited
+        s["elapsed"] += elapsed
+
+
+# --------------------------------------------------------------------------- #
+# {phase: {calls, polls, waited, elapsed}} where waited is the wall-clock
+# seconds spent sleeping between polls and elapsed the total time in poll()
+def wait_stats():
+    with _stats_lock:
+        return {phase: dict(s) for phase, s in _stats.items()}
+
+
+def reset_wait_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+# --------------------------------------------------------------------------- #
+# Calls check() until it returns, sleeping on the shared scheduler between
+# calls as the backoff policy dictates.  NotReady and any exception types in
+# retry_on mean "poll again", everything else propagates.  Raises WaitTimeout
+# when the policy gives up.
+def poll(check, backoff=None, phase="poll", retry_on=()):
+    if backoff is None:
+        backoff = Backoff()
+    retry_on = (NotReady,) + tuple(retry_on)
+
+    start = monotonic()
+    waited = 0.0
+    attempt = 0
+    last_exc = None
+    try:
+        while backoff.allows(attempt, monotonic() - start):
+            delay = backoff.delay(attempt)
+            if backoff.timeout is not None:
+                delay = min(delay, max(backoff.timeout - (monotonic() - start), 0.0))
+            _scheduler.sleep(delay)
+            waited += delay
+            attempt += 1
+            try:
+                return check()
+            except retry_on as e:
+                last_exc = e
+        raise WaitTimeout(phase, monotonic() - start, last_exc)
+    finally:
+        _record(phase, attempt, waited, monotonic() - start)
+
+
+# --------------------------------------------------------------------------- #
+# sleeps on the shared scheduler, for callers that drive their own loop
+def sleep(seconds):
+    _scheduler.sleep(seconds)
@@ -0,0 +1,207 @@
+import os
+import json
+import shutil
+import tempfile
+import threading
+import socketserver
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+from gwerks.docker_api import DockerApi, DockerApiException
+
+
+# --------------------------------------------------------------------------- #
+# A stand-in Docker daemon on a unix socket.  `routes` maps (method, path) to
+# a function taking the handler and returning (status, body); a list body is
+# streamed chunked as JSON lines.  Every request and connection is recorded.
+class FakeDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, routes):
+        self.routes = routes
+        self.requests = []
+        self.connections = 0
+        super().__init__(socket_path, _Handler)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        self._handle()
+
+    def do_DELETE(self):
+        self._handle()
+
+    def _handle(self):
+        path, _, query = self.path.partition("?")
+        self.body = self._read_body()
+        self.server.requests.append((self.command, path, query, self.body))
+        route = self.server.routes.get((self.command, path))
+        status, body = route(self) if route else (404, {"message": f"no such route {path}"})
+
+        self.send_response(status)
+        if isinstance(body, list):
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for message in body:
+                data = json.dumps(message).encode() + b"\r\n"
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.write(b"0\r\n\r\n")
+            return
+        data = b"" if body is None else json.dumps(body).encode()
+        if data:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if data:
+            self.wfile.write(data)
+
+    def _read_body(self):
+        if self.headers.get("Transfer-Encoding") == "chunked":
+            body = b""
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                chunk = self.rfile.read(size + 2)[:size]
+                if size == 0:
+                    return body
+                body += chunk
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def address_string(self):
+        return "unix"
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def daemon():
+    # unix socket paths are short, keep it out of pytest's long tmp_path
+    tmp = tempfile.mkdtemp(prefix="gwerks-")
+    server = FakeDaemon(os.path.join(tmp, "docker.sock"), {})
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+@pytest.fixture
+def api(daemon):
+    api = DockerApi(socket_path=daemon.server_address, timeout=5)
+    yield api
+    api.close()
+
+
+def test_ping(daemon, api):
+    daemon.routes[("GET", "/_ping")] = lambda h: (200, None)
+    assert api.ping()
+
+
+def test_ping_is_false_on_an_error_status(daemon, api):
+    daemon.routes[("GET", "/_ping")] = lambda h: (500, {"message": "daemon is sick"})
+    assert api.ping() is False
+
+
+def test_ping_is_false_without_a_daemon(tmp_path):
+    assert DockerApi(socket_path=str(tmp_path / "missing.sock")).ping() is False
+
+
+def test_network_inspect(daemon, api):
+    daemon.routes[("GET", "/networks/my%20net")] = lambda h: (200, {"Name": "my net", "Driver": "bridge"})
+    assert api.network_inspect("my net") == {"Name": "my net", "Driver": "bridge"}
+    assert api.network_inspect("missing") is None
+
+
+def test_network_create(daemon, api):
+    daemon.routes[("POST", "/networks/create")] = lambda h: (201, {"Id": "abc123"})
+    assert api.network_create("net1", "bridge") == "abc123"
+    method, path, query, body = daemon.requests[-1]
+    assert json.loads(body) == {"Name": "net1", "Driver": "bridge"}
+
+
+def test_network_create_conflict_raises(daemon, api):
+    daemon.routes[("POST", "/networks/create")] = lambda h: (409, {"message": "network net1 already exists"})
+    with pytest.raises(DockerApiException) as e:
+        api.network_create("net1", "bridge")
+    assert e.value.status == 409
+    assert e.value.message == "network net1 already exists"
+
+
+def test_network_remove(daemon, api):
+    daemon.routes[("DELETE", "/networks/net1")] = lambda h: (204, None)
+    api.network_remove("net1")
+    api.network_remove("missing")  # a 404 is fine
+    assert [r[1] for r in daemon.requests] == ["/networks/net1", "/networks/missing"]
+
+
+def test_keep_alive_connection_is_reused(daemon, api):
+    daemon.routes[("GET", "/_ping")] = lambda h: (200, None)
+    for _ in range(3):
+        assert api.ping()
+    assert daemon.connections == 1
+
+
+def test_retries_once_when_the_daemon_drops_the_idle_connection(daemon, api):
+    def ping_then_hang_up(handler):
+        # no Connection: close header, the client finds out on its next request
+        handler.close_connection = True
+        return 200, None
+    daemon.routes[("GET", "/_ping")] = ping_then_hang_up
+    daemon.routes[("GET", "/networks/net1")] = lambda h: (200, {"Name": "net1"})
+
+    assert api.ping()
+    assert api.network_inspect("net1") == {"Name": "net1"}
+    assert daemon.connections == 2
+
+
+def test_api_version_prefixes_the_path(daemon):
+    daemon.routes[("GET", "/v1.41/_ping")] = lambda h: (200, None)
+    api = DockerApi(socket_path=daemon.server_address, api_version="v1.41")
+    try:
+        assert api.ping()
+    finally:
+        api.close()
+
+
+def test_build_streams_a_chunked_context_and_messages(daemon, api):
+    daemon.routes[("POST", "/build")] = lambda h: (200, [{"stream": "Step 1/2"}, {"stream": "Step 2/2"}])
+    messages = list(api.build(iter([b"tar", b"-", b"bytes"]), "app:latest", buildargs={"A": "1"}))
+
+    assert messages == [{"stream": "Step 1/2"}, {"stream": "Step 2/2"}]
+    method, path, query, body = daemon.requests[-1]
+    assert body == b"tar-bytes"
+    assert "t=app%3Alatest" in query
+    assert "buildargs=" in query
+
+
+def test_build_raises_on_an_error_message(daemon, api):
+    daemon.routes[("POST", "/build")] = lambda h: (200, [{"stream": "Step 1/2"},
+                                                        {"error": "COPY failed: no such file"}])
+    messages = []
+    with pytest.raises(DockerApiException) as e:
+        for message in api.build(b"tar-bytes", "app:latest"):
+            messages.append(message)
+    assert messages == [{"stream": "Step 1/2"}]
+    assert e.value.message == "COPY failed: no such file"
+
+
+def test_build_raises_on_an_error_status(daemon, api):
+    daemon.routes[("POST", "/build")] = lambda h: (500, {"message": "Cannot locate specified Dockerfile"})
+    with pytest.raises(DockerApiException) as e:
+        list(api.build(b"tar-bytes", "app:latest"))
+    assert e.value.status == 500
@@ -0,0 +1,124 @@
+from fnmatch import fnmatchcase
+
+import pytest
+
+from gwerks.docker import DockerBase
+from gwerks.dockerignore import DockerIgnore, read_dockerignore
+
+# the patterns DOCKER_IGNORE_PATTERNS replaced, as given to shutil.ignore_patterns,
+# which tested them against every entry name at every depth
+OLD_IGNORE_PATTERNS = ['build*', 'data*', 'dist*', '.git*', '.github*']
+
+
+def _old_ignored(path):
+    return any(fnmatchcase(name, pattern) for name in path.split("/") for pattern in OLD_IGNORE_PATTERNS)
+
+
+@pytest.mark.parametrize("path", [
+    "build",
+    "build.sh",
+    "builder/main.py",
+    "src/build",
+    "src/build/lib/x.py",
+    "src/rebuild.py",
+    "data",
+    "data.csv",
+    "app/data/seed.json",
+    "app/metadata.json",
+    "dist",
+    "pkg/dist-info/RECORD",
+    "distro.txt",
+    ".git",
+    ".git/config",
+    ".gitignore",
+    "sub/.github/workflows/ci.yml",
+    "sub/.gitattributes",
+    "github/README.md",
+    "src/app.py",
+    "Dockerfile",
+    "requirements.txt",
+])
+def test_default_patterns_match_the_old_ignore_patterns(path):
+    assert DockerIgnore(DockerBase.DOCKER_IGNORE_PATTERNS).matches(path) == _old_ignored(path)
+
+
+@pytest.mark.parametrize("patterns, path, excluded", [
+    # plain names match at the root only, and everything under a match
+    (["foo"], "foo", True),
+    (["foo"], "foo/bar.txt", True),
+    (["foo"], "src/foo", False),
+    (["/foo"], "foo/bar.txt", True),
+    (["foo/"], "foo/bar.txt", True),
+    # * and ? stay within a component
+    (["*.md"], "README.md", True),
+    (["*.md"], "docs/README.md", False),
+    (["*/*.md"], "docs/README.md", True),
+    (["?.txt"], "a.txt", True),
+    (["?.txt"], "ab.txt", False),
+    (["[a-c].txt"], "b.txt", True),
+    (["[!a-c].txt"], "b.txt", False),
+    (["[!a-c].txt"], "d.txt", True),
+    (["\\*.txt"], "*.txt", True),
+    (["\\*.txt"], "a.txt", False),
+    # ** matches any number of components, including none
+    (["**/*.pyc"], "a.pyc", True),
+    (["**/*.pyc"], "a/b/c.pyc", True),
+    (["docs/**/*.md"], "docs/index.md", True),
+    (["docs/**/*.md"], "docs/a/b/index.md", True),
+    (["docs/**"], "docs/a/b", True),
+    (["docs/**"], "src/docs/a", False),
+    # the last matching pattern decides
+    (["*.md", "!README*.md"], "README.md", False),
+    (["*.md", "!README*.md"], "CHANGES.md", True),
+    (["*.md", "!README*.md", "README-secret.md"], "README-secret.md", True),
+    (["!README.md", "*.md"], "README.md", True),
+    # ! re-includes under an excluded directory
+    (["foo", "!foo/keep"], "foo/keep", False),
+    (["foo", "!foo/keep"], "foo/keep/a.txt", False),
+    (["foo", "!foo/keep"], "foo/other", True),
+    (["**/build*", "!src/build"], "src/build/lib/x.py", False),
+    (["**/build*", "!src/build"], "build/x.py", True),
+    (["**/build*", "!src/build"], "a/src/build", True),
+    # patterns are normalized, empty ones ignored
+    (["./foo/../bar"], "bar/x", True),
+    ([""], "foo", False),
+])
+def test_matches(patterns, path, excluded):
+    assert DockerIgnore(patterns).matches(path) == excluded
+
+
+@pytest.mark.parametrize("patterns, path, pruned", [
+    # not excluded at all
+    (["foo"], "bar", False),
+    # excluded, and nothing re-includes anything below it
+    (["foo"], "foo", True),
+    (["foo", "!bar/keep"], "foo", True),
+    (["foo", "!foo"], "foo", False),
+    # a ! pattern that may match below it keeps the walk going
+    (["foo", "!foo/keep"], "foo", False),
+    (["foo", "!foo/*/keep"], "foo", False),
+    (["foo", "!foo/*/keep"], "foo/a", False),
+    (["foo", "!foo/*/keep"], "foo/a/b", True),
+    (["foo", "!**/keep"], "foo", False),
+    (["foo", "!**/keep"], "foo/a/b", False),
+    (["foo", "!f*/keep"], "foo", False),
+    (["foo", "!g*/keep"], "foo", True),
+    # a ! pattern as deep as the directory itself has already had its say
+    (["foo/*", "!foo/keep"], "foo/other", True),
+    (["**/build*", "!src/build"], "build", True),
+    (["**/build*", "!src/build"], "src/build", False),
+    (["**/build*", "!src/build"], "lib/build", True),
+])
+def test_excludes_dir(patterns, path, pruned):
+    assert DockerIgnore(patterns).excludes_dir(path) == pruned
+
+
+def test_empty_exclusion_is_an_error():
+    with pytest.raises(Exception):
+        DockerIgnore(["!"])
+
+
+def test_read_dockerignore(tmp_path):
+    path = tmp_path / ".dockerignore"
+    path.write_text("# comment\n\n  *.log  \n!keep.log\n", encoding="utf-8")
+    assert read_dockerignore(str(path)) == ["*.log", "!keep.log"]
@@ -0,0 +1,27 @@
+from time import monotonic
+
+import pytest
+
+from gwerks.util.sys import exec_cmd_stream, CommandTimeoutException
+
+
+def test_timeout_kills_a_command_that_keeps_writing():
+    start = monotonic()
+    with pytest.raises(CommandTimeoutException):
+        for _ in exec_cmd_stream("yes", timeout=1):
+            pass
+    assert monotonic() - start < 3
+
+
+def test_idle_timeout_kills_a_silent_command():
+    with pytest.raises(CommandTimeoutException):
+        for _ in exec_cmd_stream("sleep 10", idle_timeout=0.5):
+            pass
+
+
+def test_streams_output_and_exit_code():
+    stream = exec_cmd_stream("echo out; echo err >&2", timeout=10)
+    lines = list(stream)
+    assert ("stdout", "out") in lines
+    assert ("stderr", "err") in lines
+    assert stream.returncode == 0